@@ -5,15 +5,36 @@ import io
 import json
 import PyPDF2
 import tempfile
-import glob
-import qrcode
 import hashlib
 import base64
-from gtts import gTTS
-from datetime import datetime, timedelta
-from PIL import Image, ImageDraw, ImageFont
+import click
+import bisect
+import threading
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from datetime import datetime
+from jinja2 import FileSystemBytecodeCache
 from langdetect import detect
 from langdetect.lang_detect_exception import LangDetectException
+from medication_extractor import extract_medications_from_discharge_letter
+from instruction_store import create_instruction_store
+from audio_queue import AudioJobQueue
+from tts_backends import create_tts_backend
+from speech_text import html_to_speech_text
+from request_logging import configure_logging, init_request_ids
+from qr_renderer import IMAGE_FORMATS, QRRenderer, create_render_executor
+from qr_stickers import get_sticker_layout, write_sticker_sheet
+from static_assets import BuiltAsset, StaticAsset, choose_encoding
+from file_cache import evict_lru_files, mark_used, write_file_atomically
+
+# Log level and line format ('text', or 'json' for log collectors); every line carries the request id
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+configure_logging(LOG_LEVEL, LOG_FORMAT)
+logger = logging.getLogger(__name__)
 
 # Try to import zebra, but continue if not available - we no longer use it, but keeping the check
 # for backward compatibility
@@ -22,18 +43,89 @@ try:
     ZEBRA_AVAILABLE = True
 except ImportError:
     ZEBRA_AVAILABLE = False
-    print("Warning: python-zebra is not installed. Thermal printer support will be disabled.")
+    logger.warning("python-zebra is not installed. Thermal printer support will be disabled.")
 
 app = Flask(__name__)
+init_request_ids(app)
+
+# Compiled templates are kept on disk, so new worker processes don't recompile them
+JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR', os.path.join(app.instance_path, 'jinja_cache'))
+os.makedirs(JINJA_BYTECODE_CACHE_DIR, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_BYTECODE_CACHE_DIR)
+
+# Rendered instruction pages, kept in a bounded LRU keyed by a hash of the instruction id, the
+# page's content and the template, which is also the page's ETag. Browsers revalidate on each
+# scan (the audio may have become ready since), and unchanged pages are answered with 304.
+INSTRUCTION_PAGE_CACHE_SIZE = int(os.environ.get('INSTRUCTION_PAGE_CACHE_SIZE', 1024))
+instruction_page_cache = OrderedDict()
+instruction_page_cache_lock = threading.Lock()
+
+# Templates whose rendered pages are cached, watched for edits on disk (see get_template_version())
+page_templates = {name: StaticAsset(os.path.join(app.root_path, app.template_folder, name), 'text/html',
+                                    compress=False)
+                  for name in ('instruction.html', 'flask_ui_updated.html')}
+
+def get_template_version(name):
+    """
+    Hash of a page template's source. An edited template is only re-read when Jinja reloads
+    it too (debug mode or TEMPLATES_AUTO_RELOAD), so the version matches what is rendered.
+    """
+    template = page_templates[name]
+    if app.jinja_env.auto_reload or template.version is None:
+        return template.current().fingerprint
+    return template.version.fingerprint
 
-# Directory for storing QR codes
-QR_DIR = os.path.join(app.static_folder, 'qrcodes')
+# Shared QR code renderer. QR_RENDER_POOL ('thread' or 'process') spreads batch renders
+# over QR_RENDER_WORKERS workers (default one per CPU); unset renders in the request thread.
+QR_RENDER_POOL = os.environ.get('QR_RENDER_POOL', '')
+QR_RENDER_WORKERS = int(os.environ.get('QR_RENDER_WORKERS', 0)) or None
+qr_renderer = QRRenderer()
+qr_render_executor = create_render_executor(QR_RENDER_POOL, QR_RENDER_WORKERS)
+
+# QR codes are rendered on demand by /qr/<instruction_id>.png|svg|pdf rather than saved to disk.
+# Rendered images are kept in a bounded LRU keyed by render key, which is also their ETag.
+QR_IMAGE_CACHE_SIZE = int(os.environ.get('QR_IMAGE_CACHE_SIZE', 512))
+QR_IMAGE_MAX_AGE = int(os.environ.get('QR_IMAGE_MAX_AGE', 86400))
+QR_IMAGE_MIMETYPES = {'png': 'image/png', 'svg': 'image/svg+xml', 'pdf': 'application/pdf'}
+qr_image_cache = OrderedDict()
+qr_image_cache_lock = threading.Lock()
+
+# Longest ?label= accepted by /qr/<instruction_id>. Only images labelled with the stored
+# medication name go into the LRU, so arbitrary labels can't flush it.
+QR_LABEL_MAX_LENGTH = int(os.environ.get('QR_LABEL_MAX_LENGTH', 200))
+
+# Largest sticker batch accepted by /generate_qr_stickers, and the size past which the
+# sticker PDF is spooled to a temporary file rather than held in memory
+STICKER_MAX_LABELS = int(os.environ.get('STICKER_MAX_LABELS', 2000))
+STICKER_SPOOL_BYTES = 1024 * 1024
 
 # Directory for storing audio files
 AUDIO_DIR = os.path.join(app.static_folder, 'audio')
 
+# Text-to-speech engine for the spoken instructions: 'gtts' (default, needs network access),
+# 'espeak' or 'piper' (offline, run locally), or 'stub' (silent audio, for testing).
+# piper needs a voice model per language, e.g. "en-gb=/opt/piper/en_GB-alba-medium.onnx".
+TTS_BACKEND = os.environ.get('TTS_BACKEND', 'gtts')
+TTS_PIPER_MODELS = os.environ.get('TTS_PIPER_MODELS', '')
+tts_backend = create_tts_backend(TTS_BACKEND, TTS_PIPER_MODELS)
+
+# Spoken instructions are cached in AUDIO_DIR under a hash of the text, language and TTS
+# engine, so identical instructions are synthesised once. The least recently played files
+# are evicted once the cache grows past AUDIO_CACHE_MAX_MB.
+AUDIO_EXTENSIONS = ('.mp3', '.wav')
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get('AUDIO_CACHE_MAX_MB', 200)) * 1024 * 1024
+
+# Audio is synthesised in the background by AUDIO_WORKERS threads, so requests never wait
+# on the TTS service. A failed synthesis is retried after AUDIO_RETRY_AFTER seconds.
+AUDIO_WORKERS = int(os.environ.get('AUDIO_WORKERS', 2))
+AUDIO_RETRY_AFTER = int(os.environ.get('AUDIO_RETRY_AFTER', 60))
+audio_jobs = AudioJobQueue(AUDIO_WORKERS, AUDIO_RETRY_AFTER)
+
+# Queue the audio for every stored instruction that isn't cached yet when the app starts.
+# With several worker processes prefer running `flask prewarm-audio` once instead.
+AUDIO_PREWARM = os.environ.get('AUDIO_PREWARM', '').lower() in ('1', 'true', 'yes')
+
 # Create directories if they don't exist
-os.makedirs(QR_DIR, exist_ok=True)
 os.makedirs(AUDIO_DIR, exist_ok=True)
 
 # Dictionary to store instruction texts
@@ -49,130 +141,347 @@ os.makedirs(BACKUP_DIR, exist_ok=True)
 # Create data directory if it doesn't exist
 data_dir = os.path.join(app.static_folder, 'data')
 os.makedirs(data_dir, exist_ok=True)
-print(f"Ensuring data directory exists: {data_dir}")
+logger.debug("Ensuring data directory exists: %s", data_dir)
+
+# Instruction storage backend: 'sqlite' (default), 'journal' (instructions.json plus an
+# append-only journal) or 'json' (rewrites instructions.json on every save)
+INSTRUCTION_STORE_BACKEND = os.environ.get('INSTRUCTION_STORE', 'sqlite')
+
+# SQLite database for instruction data, kept out of the static folder so it isn't served.
+# A new database is seeded from instructions.json, which remains available as an export format.
+INSTRUCTION_DB_FILE = os.environ.get('INSTRUCTION_DB_FILE', os.path.join(app.instance_path, 'instructions.db'))
+
+# Journal of instruction changes used by the 'journal' store, and how many entries
+# it may hold before it is compacted into instructions.json in the background
+INSTRUCTION_JOURNAL_FILE = os.path.join(app.static_folder, 'data', 'instructions.journal')
+INSTRUCTION_JOURNAL_COMPACT_AFTER = int(os.environ.get('INSTRUCTION_JOURNAL_COMPACT_AFTER', 500))
+
+instruction_store = create_instruction_store(INSTRUCTION_STORE_BACKEND, INSTRUCTION_DATA_FILE, INSTRUCTION_DB_FILE,
+                                             INSTRUCTION_JOURNAL_FILE, INSTRUCTION_JOURNAL_COMPACT_AFTER)
+
+# instruction_texts is an in-memory copy of the instruction store. Other worker processes
+# save to the store too, so the copy is tagged with the store version it was loaded at
+# and reloaded by sync_instruction_texts() whenever the store has moved on.
+instruction_texts_lock = threading.RLock()
+instruction_texts_version = None
+
+# Ids that were looked up but aren't stored are remembered for INSTRUCTION_MISS_TTL seconds
+# (up to INSTRUCTION_MISS_CACHE_SIZE ids), so a broken sticker or a bot can't make every
+# request go to the store. Each client may look up INSTRUCTION_MISS_RATE_LIMIT unknown ids
+# a minute before getting 429 responses (0 turns the limit off).
+INSTRUCTION_MISS_TTL = float(os.environ.get('INSTRUCTION_MISS_TTL', 60))
+INSTRUCTION_MISS_CACHE_SIZE = int(os.environ.get('INSTRUCTION_MISS_CACHE_SIZE', 4096))
+INSTRUCTION_MISS_RATE_LIMIT = int(os.environ.get('INSTRUCTION_MISS_RATE_LIMIT', 60))
+instruction_misses = OrderedDict()
+instruction_misses_lock = threading.Lock()
 
 # Load existing instruction data if available
 def load_instruction_data():
-    global instruction_texts
-    if os.path.exists(INSTRUCTION_DATA_FILE):
-        try:
-            with open(INSTRUCTION_DATA_FILE, 'r') as f:
-                instruction_texts = json.load(f)
-            print(f"Loaded {len(instruction_texts)} instructions from file")
-        except Exception as e:
-            print(f"Error loading instruction data: {e}")
+    global instruction_texts, instruction_texts_version
+    try:
+        with instruction_texts_lock:
+            version = instruction_store.version()
+            # Swap in a new dict rather than clearing the old one under readers' feet
+            instruction_texts = instruction_store.load_all()
+            instruction_texts_version = version
+        # Remembered misses may have been saved since
+        with instruction_misses_lock:
+            instruction_misses.clear()
+        logger.debug("Loaded %d instructions from %s store", len(instruction_texts), instruction_store.name)
+        return True
+    except Exception as e:
+        logger.exception("Error loading instruction data")
+        return False
 
-# Save instruction data to file
-def save_instruction_data():
+# Reload instruction_texts if another worker has saved to the instruction store.
+# Returns whether instruction_texts is now known to match the store.
+def sync_instruction_texts():
     try:
-        with open(INSTRUCTION_DATA_FILE, 'w') as f:
-            json.dump(instruction_texts, f, indent=2)
-        print(f"Saved {len(instruction_texts)} instructions to file")
+        if instruction_store.version() != instruction_texts_version:
+            return load_instruction_data()
         return True
     except Exception as e:
-        print(f"Error saving instruction data: {e}")
+        logger.exception("Error checking instruction store version")
         return False
 
+# Save a single instruction to memory and to the instruction store
+def save_instruction(instruction_id, instruction_data):
+    return save_instructions({instruction_id: instruction_data})
+
+# Save several instructions to memory and to the instruction store in one write
+def save_instructions(instructions):
+    global instruction_texts_version
+    with instruction_texts_lock:
+        instruction_texts.update(instructions)
+        with instruction_misses_lock:
+            for instruction_id in instructions:
+                instruction_misses.pop(instruction_id, None)
+        try:
+            previous_version, version = instruction_store.put_many(instructions)
+        except Exception as e:
+            logger.exception("Error saving instruction data")
+            return False
+        # Only our own write happened since the last load, so the copy is still complete
+        if previous_version == instruction_texts_version:
+            instruction_texts_version = version
+        return True
+
 # Load instruction data at startup
 load_instruction_data()
 
+def lookup_instruction(instruction_id):
+    """
+    Return the stored data for an instruction id, or None if there is no such instruction.
+    instruction_texts mirrors the store, so lookups are answered from memory; the store is
+    only asked when the mirror can't be brought up to date. Misses are remembered for
+    INSTRUCTION_MISS_TTL seconds, until the store changes.
+    """
+    # Sync first: reloading after another worker's save forgets the remembered misses
+    in_sync = sync_instruction_texts()
+    
+    now = time.monotonic()
+    with instruction_misses_lock:
+        expires = instruction_misses.get(instruction_id)
+        if expires is not None:
+            if expires > now:
+                return None
+            del instruction_misses[instruction_id]
+    
+    instruction_info = instruction_texts.get(instruction_id)
+    if instruction_info is None and not in_sync:
+        try:
+            instruction_info = instruction_store.get(instruction_id)
+        except Exception:
+            logger.exception("Error loading instruction %s from the instruction store", instruction_id)
+        if instruction_info is not None:
+            with instruction_texts_lock:
+                instruction_texts[instruction_id] = instruction_info
+    
+    if instruction_info is None:
+        with instruction_misses_lock:
+            instruction_misses[instruction_id] = now + INSTRUCTION_MISS_TTL
+            instruction_misses.move_to_end(instruction_id)
+            while len(instruction_misses) > INSTRUCTION_MISS_CACHE_SIZE:
+                instruction_misses.popitem(last=False)
+    return instruction_info
+
+class ClientRateLimiter:
+    """
+    Allows each client at most `limit` events per `window` seconds; a limit of 0 allows
+    everything. Limits are per worker process: to share them between workers, replace
+    instruction_miss_limiter with an object with the same allow() method (e.g. Redis-backed).
+    """
+    
+    def __init__(self, limit, window=60, max_clients=10000):
+        self.limit = limit
+        self.window = window
+        self.max_clients = max_clients
+        self.clients = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def allow(self, client):
+        """Count an event for client and return whether it is within the limit"""
+        if not self.limit:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            window_start, count = self.clients.get(client, (now, 0))
+            if now - window_start >= self.window:
+                window_start, count = now, 0
+            self.clients[client] = (window_start, count + 1)
+            self.clients.move_to_end(client)
+            while len(self.clients) > self.max_clients:
+                self.clients.popitem(last=False)
+            return count < self.limit
+
+# Rate-limit hook for lookups of unknown instruction ids, keyed by client address
+instruction_miss_limiter = ClientRateLimiter(INSTRUCTION_MISS_RATE_LIMIT)
+
+def instruction_miss_allowed():
+    """Whether the client making this request may be told about another unknown instruction id"""
+    return instruction_miss_limiter.allow(request.remote_addr)
+
+def instruction_not_found_response():
+    """JSON error for an unknown instruction id, or 429 once the client is over the miss rate limit"""
+    if not instruction_miss_allowed():
+        return jsonify({'status': 'error', 'message': 'Too many requests for unknown instructions'}), 429
+    return jsonify({'status': 'error', 'message': 'Instruction not found'}), 404
+
+# Get a rendered QR code image from the LRU cache, rendering it on a miss
+def get_qr_image(url, label, image_format, cache=True):
+    render_key = qr_renderer.render_key(url, label, image_format)
+    with qr_image_cache_lock:
+        image = qr_image_cache.get(render_key)
+        if image is not None:
+            qr_image_cache.move_to_end(render_key)
+            return render_key, image
+    
+    image = qr_renderer.render_image(url, label, image_format)
+    if cache:
+        cache_qr_image(render_key, image)
+    return render_key, image
+
+def cache_qr_image(render_key, image):
+    with qr_image_cache_lock:
+        qr_image_cache[render_key] = image
+        qr_image_cache.move_to_end(render_key)
+        while len(qr_image_cache) > QR_IMAGE_CACHE_SIZE:
+            qr_image_cache.popitem(last=False)
+
+# Render QR codes for a list of (instruction_id, label) pairs in one batch, so the
+# images the page is about to request are already cached. Cached images are skipped.
+def prerender_qr_images(pages, image_format='png'):
+    jobs = {}
+    for instruction_id, label in pages:
+        url = url_for('instruction_page', instruction_id=instruction_id, _external=True)
+        render_key = qr_renderer.render_key(url, label, image_format)
+        with qr_image_cache_lock:
+            cached = render_key in qr_image_cache
+        if not cached:
+            jobs[render_key] = (url, label)
+    
+    images = qr_renderer.render_batch(jobs.values(), qr_render_executor, image_format)
+    for render_key, image in zip(jobs, images):
+        cache_qr_image(render_key, image)
+
+# QR image format requested by a QR generation request: 'png' (default), 'svg' or 'pdf'
+def requested_qr_format(data):
+    image_format = (data.get('format') or request.args.get('format') or 'png').lower()
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported QR code format: {image_format}")
+    return image_format
+
+# URL of the on-demand QR code image for an instruction, labelled with the medication name
+def qr_image_url(instruction_id, medication_name='', image_format='png'):
+    return url_for('qr_image', instruction_id=instruction_id, image_format=image_format,
+                   label=medication_name or None)
+
 # Path to the original HTML file
 # The original HTML file is in the parent directory
 ORIGINAL_HTML_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'chartgenerator.html')
 
+# Data files the chart generator loads, served from memory (see static_assets.py) at
+# /assets/<fingerprint>/<name>. Fingerprinted URLs are cached by browsers for
+# STATIC_ASSET_MAX_AGE seconds and never revalidated; a changed file gets a new fingerprint.
+STATIC_ASSET_MAX_AGE = int(os.environ.get('STATIC_ASSET_MAX_AGE', 31536000))
+STATIC_ASSET_FILES = ('bnf_labels.json', 'drug_aliases.json', 'drug_formulations.json',
+                      'formulation_aliases.json', 'translations.json')
+static_assets = {name: StaticAsset(os.path.join(app.static_folder, name), 'application/json')
+                 for name in STATIC_ASSET_FILES}
+
+# The chart generator page and the Flask UI page are built once, with the fingerprinted
+# asset URLs filled in, and served precompressed from memory. Their URLs aren't versioned,
+# so browsers revalidate them on each visit and unchanged pages are answered with 304.
+original_html = StaticAsset(ORIGINAL_HTML_PATH, 'text/html', compress=False)
+
+def get_static_asset_urls():
+    """Fingerprinted URL of each static asset, by file name"""
+    urls = {}
+    for name, asset in static_assets.items():
+        try:
+            urls[name] = url_for('static_asset', fingerprint=asset.current().fingerprint, name=name)
+        except FileNotFoundError:
+            # Pages fall back to the file's /static/ URL
+            logger.warning("Static asset not found: %s", asset.path)
+    return urls
+
+def get_original_page_key():
+    """The chartgenerator.html version, script root and asset URLs the original page is built from"""
+    return (original_html.current().fingerprint, request.script_root,
+            tuple(sorted(get_static_asset_urls().items())))
+
+def build_original_page(key):
+    """chartgenerator.html with the fingerprinted asset URLs set as window.ASSET_URLS"""
+    urls = json.dumps(dict(key[2])).replace('</', '<\\/')
+    script = f"<script>window.ASSET_URLS = {urls};</script>\n".encode('utf-8')
+    return original_html.current().bodies['identity'].replace(b'</head>', script + b'</head>', 1)
+
+original_page = BuiltAsset(build_original_page)
+index_page = BuiltAsset(lambda key: render_template('flask_ui_updated.html').encode('utf-8'))
+
+def static_asset_response(version, mimetype, immutable=False):
+    """Serve an in-memory asset in the best coding the client accepts, answering revalidations with 304"""
+    encoding = choose_encoding(version, request.accept_encodings)
+    etag = f"{version.fingerprint}-{encoding}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(version.bodies[encoding], mimetype=mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_ASSET_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+@app.route('/assets/<fingerprint>/<name>')
+def static_asset(fingerprint, name):
+    asset = static_assets.get(name)
+    try:
+        version = asset.current() if asset else None
+    except FileNotFoundError:
+        version = None
+    if version is None:
+        return jsonify({'status': 'error', 'message': 'Asset not found'}), 404
+    # A page loaded before the file changed may still ask for the old fingerprint: it gets
+    # the current content, but not for keeps
+    return static_asset_response(version, asset.mimetype, immutable=fingerprint == version.fingerprint)
+
 @app.route('/')
 def index():
-    # Clean up old temp files on startup
-    cleanup_temp_files(hours=24)
-    # Clean up old audio files
-    cleanup_audio_files(hours=1)
-    # Render the Flask UI template
-    return render_template('flask_ui_updated.html')
-
-@app.route('/cleanup_temp', methods=['POST'])
-def cleanup_temp():
-    """Clean up temporary PDF files"""
-    try:
-        # Get the file to clean up from the request
-        data = request.json
-        filename = data.get('filename', None)
-        
-        if filename:
-            # Clean up a specific file
-            file_path = os.path.join(app.static_folder, 'temp', filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                return jsonify({'status': 'success', 'message': f'File {filename} deleted'})
-            else:
-                return jsonify({'status': 'error', 'message': f'File {filename} not found'})
-        else:
-            # Clean up all files older than 1 hour
-            num_deleted = cleanup_temp_files(hours=1)
-            return jsonify({'status': 'success', 'message': f'Deleted {num_deleted} temporary files'})
-    except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+    # Render the Flask UI template once per template version, then serve it from memory
+    version = index_page.current((get_template_version('flask_ui_updated.html'), request.script_root))
+    return static_asset_response(version, 'text/html')
 
-def cleanup_temp_files(hours=1):
-    """Delete temporary files older than the specified number of hours"""
-    temp_dir = os.path.join(app.static_folder, 'temp')
-    if not os.path.exists(temp_dir):
-        return 0
-        
-    # Get current time
-    now = datetime.now()
-    count = 0
-    
-    # Check all files in the temp directory
-    for file_path in glob.glob(os.path.join(temp_dir, '*')):
-        # Skip directories
-        if os.path.isdir(file_path):
-            continue
-            
-        # Get file modification time
-        file_mod_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-        
-        # If file is older than specified hours, delete it
-        if now - file_mod_time > timedelta(hours=hours):
-            try:
-                os.remove(file_path)
-                count += 1
-            except Exception as e:
-                print(f"Error deleting {file_path}: {e}")
-                
-    return count
+def get_audio_filename(spoken_text, tts_lang):
+    """Cache filename for the audio, from a hash of everything that determines it"""
+    inputs = [tts_backend.name, tts_backend.voice(tts_lang), spoken_text]
+    audio_key = hashlib.sha256(json.dumps(inputs).encode('utf-8')).hexdigest()
+    return f"{audio_key}.{tts_backend.extension}"
 
-def cleanup_audio_files(hours=1):
-    """Delete audio files older than the specified number of hours"""
-    if not os.path.exists(AUDIO_DIR):
-        return 0
-        
-    # Get current time
-    now = datetime.now()
-    count = 0
+def is_audio_cached(audio_filename):
+    """Check whether the audio file is in the cache, marking it as recently used if it is"""
+    return mark_used(os.path.join(AUDIO_DIR, audio_filename))
+
+def get_or_create_audio(spoken_text, tts_lang):
+    """
+    Return the filename (inside AUDIO_DIR) of the audio of spoken_text in tts_lang,
+    synthesising it only if the same text has not been spoken in that language before.
+    Raises if the text-to-speech engine fails.
+    """
+    audio_filename = get_audio_filename(spoken_text, tts_lang)
+    audio_path = os.path.join(AUDIO_DIR, audio_filename)
     
-    # Check all files in the audio directory
-    for file_path in glob.glob(os.path.join(AUDIO_DIR, '*.mp3')):
-        # Get file modification time
-        file_mod_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-        
-        # If file is older than specified hours, delete it
-        if now - file_mod_time > timedelta(hours=hours):
-            try:
-                os.remove(file_path)
-                count += 1
-                print(f"Deleted old audio file: {file_path}")
-            except Exception as e:
-                print(f"Error deleting {file_path}: {e}")
-                
-    return count
+    if is_audio_cached(audio_filename):
+        return audio_filename
+    
+    logger.debug("Generating %s audio with %s for text: %r", tts_lang, tts_backend.name, spoken_text)
+    
+    # A page loaded while the audio is being generated never gets a half-written file
+    write_file_atomically(audio_path, lambda tmp_path: tts_backend.synthesise(spoken_text, tts_lang, tmp_path))
+    
+    evict_audio_cache(keep=audio_path)
+    return audio_filename
+
+def evict_audio_cache(max_bytes=None, keep=None):
+    """
+    Delete the least recently used audio files until the cache fits in max_bytes.
+    The file at `keep` (the audio that is about to be played) is never deleted.
+    Returns the number of files deleted.
+    """
+    max_bytes = AUDIO_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    return evict_lru_files(AUDIO_DIR, AUDIO_EXTENSIONS, max_bytes, keep=keep)
 
 @app.route('/original')
 def original():
-    # Serve the original HTML file directly
+    # Serve the original HTML file from memory, rebuilt when it or an asset changes on disk
     try:
-        with open(ORIGINAL_HTML_PATH, 'r') as file:
-            content = file.read()
-        return content
+        return static_asset_response(original_page.current(get_original_page_key()), 'text/html')
     except FileNotFoundError:
         # If the file is not found, return a simple message
         return f"Original HTML file not found at: {ORIGINAL_HTML_PATH}"
@@ -182,353 +491,315 @@ def admin():
     # Serve the admin page for medication data management
     return render_template('admin.html')
 
+# Form aliases used to normalize medication form terms
+FORM_ALIASES = {
+    "tablet": ["tablet", "tablets", "tabs", "tab"],
+    "capsule": ["capsule", "capsules", "caps", "cap"],
+    "inhaler": ["inhaler", "inhalator", "inhale", "inh"],
+    "spray": ["spray", "sprays"],
+    "liquid": ["liquid", "solution", "suspension", "syrup", "soln"],
+    "gel": ["gel", "jelly"],
+    "cream": ["cream", "crm", "ointment"],
+    "patch": ["patch", "patches", "plaster"]
+}
+
+# Reverse lookup from each alias to its normalized form
+FORM_ALIAS_LOOKUP = {alias: normalized_form
+                     for normalized_form, aliases in FORM_ALIASES.items()
+                     for alias in aliases}
+
 # Normalize medication form terms
 def normalize_form(form_term):
     """
     Normalize form terms to handle aliases
     """
-    form_aliases = {
-        "tablet": ["tablet", "tablets", "tabs", "tab"],
-        "capsule": ["capsule", "capsules", "caps", "cap"],
-        "inhaler": ["inhaler", "inhalator", "inhale", "inh"],
-        "spray": ["spray", "sprays"],
-        "liquid": ["liquid", "solution", "suspension", "syrup", "soln"],
-        "gel": ["gel", "jelly"],
-        "cream": ["cream", "crm", "ointment"],
-        "patch": ["patch", "patches", "plaster"]
-    }
-    
     form_term = form_term.lower()
     
-    # Check if the form term matches any of our known aliases
-    for normalized_form, aliases in form_aliases.items():
-        if form_term in aliases:
-            return normalized_form
+    # Terms that aren't a known alias are returned as they are
+    return FORM_ALIAS_LOOKUP.get(form_term, form_term)
+
+def form_match_terms(form_key):
+    """
+    Get the substrings that count as a mention of the given formulation in a medication name
+    """
+    normalized_form = normalize_form(form_key)
+    terms = [
+        form_key,
+        normalized_form,
+        f"{normalized_form}s",
+        f"{normalized_form[0:3]}",
+        f"{normalized_form[0:3]}s"
+    ]
+    if form_key == 'tablet':
+        terms.append('tab')
+    if form_key == 'capsule':
+        terms.append('cap')
+    return terms
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton that finds which of a fixed set of keywords occur
+    in a string with a single pass over the string
+    """
+    def __init__(self, keywords):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [set()]
+        
+        # Build the keyword trie
+        for keyword in keywords:
+            state = 0
+            for char in keyword:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(set())
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].add(keyword)
+        
+        # Breadth-first pass to add failure links and merge outputs along them
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.output[next_state] |= self.output[self.fail[next_state]]
+    
+    def find_all(self, text):
+        """Return the set of keywords that occur anywhere in text"""
+        goto, fail, output = self.goto, self.fail, self.output
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+class MedicationMatcher:
+    """
+    Precompiled matcher that resolves a free-text medication name to the value stored
+    for the first medication keyword it contains, preferring a formulation that is
+    also mentioned in the name. mappings is {medication: {formulation: value}}, in
+    priority order. By default a formulation match on any medication in the name wins;
+    with first_medication_only the first medication found decides on its own.
+    """
+    def __init__(self, mappings, first_medication_only=False):
+        self.first_medication_only = first_medication_only
+        self.entries = []
+        self.priority = {}
+        keywords = set()
+        
+        for med_key, formulations in mappings.items():
+            forms = [(set(form_match_terms(form_key)), info) for form_key, info in formulations.items()]
+            self.priority.setdefault(med_key, len(self.entries))
+            self.entries.append((med_key, forms))
+            keywords.add(med_key)
+            for terms, _ in forms:
+                keywords |= terms
+        
+        self.automaton = KeywordAutomaton(keywords)
+    
+    def match(self, medication_name):
+        """Return the matching formulation's value, or None if no medication keyword is found"""
+        found = self.automaton.find_all(medication_name.lower())
+        matched = sorted(self.priority[keyword] for keyword in found if keyword in self.priority)
+        if self.first_medication_only:
+            matched = matched[:1]
+        
+        for index in matched:
+            for terms, info in self.entries[index][1]:
+                if not terms.isdisjoint(found):
+                    # Both medication and formulation match - this is a perfect match
+                    return info
+        
+        # Only a medication matched, so fall back to its first formulation
+        if matched:
+            return self.entries[matched[0]][1][0][1]
+        return None
+
+# Manifest describing each medication, its formulations and their leaflet/pictorial PDFs
+PDF_MANIFEST_FILE = os.path.join(app.static_folder, 'pdfs', 'manifest.json')
+LEAFLET_DIR = os.path.join(app.static_folder, 'pdfs', 'leaflets')
+PICTORIAL_DIR = os.path.join(app.static_folder, 'pdfs', 'pictorials')
+
+# How often (seconds) to check the manifest and PDF directories for changes
+PDF_CATALOGUE_CHECK_INTERVAL = float(os.environ.get('PDF_CATALOGUE_CHECK_INTERVAL', 5))
+
+class PdfCatalogue:
+    """
+    Indexed in-memory view of the PDF manifest. Formulations whose PDF is missing
+    from the leaflet/pictorial directory are left out of the matcher for that type.
+    """
+    def __init__(self, manifest, leaflet_files, pictorial_files, version=0):
+        self.version = version
+        self.medications = []
+        available = {'leaflet': leaflet_files, 'pictorial': pictorial_files}
+        pdf_mappings = {'leaflet': {}, 'pictorial': {}}
+        display_mappings = {}
+        
+        for entry in manifest.get('medications', []):
+            med_key = entry['key'].lower()
+            self.medications.append({'name': entry['name'], 'formulation': entry.get('formulation', '')})
             
-    # If no match found, return the original term
-    return form_term
+            for formulation in entry.get('formulations', []):
+                form_key = formulation['form']
+                if formulation.get('display_name'):
+                    display_mappings.setdefault(med_key, {})[form_key] = formulation['display_name']
+                for pdf_key, filenames in available.items():
+                    filename = formulation.get(pdf_key)
+                    if not filename:
+                        continue
+                    if filename not in filenames:
+                        logger.warning("%s %s for %s is listed in the manifest but missing on disk",
+                                       pdf_key, filename, entry['name'])
+                        continue
+                    pdf_mappings[pdf_key].setdefault(med_key, {})[form_key] = filename
+        
+        self.pdf_matchers = {pdf_key: MedicationMatcher(mappings) for pdf_key, mappings in pdf_mappings.items()}
+        
+        # Display names keep their own medication order (display_order, then the rest in
+        # manifest order), and the first medication in a name decides its display name
+        display_order = [key.lower() for key in manifest.get('display_order', []) if key.lower() in display_mappings]
+        display_order += [key for key in display_mappings if key not in display_order]
+        self.display_matcher = MedicationMatcher({key: display_mappings[key] for key in display_order},
+                                                 first_medication_only=True)
 
-# Define medication keyword mappings
-def find_matching_pdf(medication_name, pdf_type):
+pdf_catalogue = None
+pdf_catalogue_signature = None
+pdf_catalogue_checked_at = 0.0
+pdf_catalogue_lock = threading.Lock()
+
+def get_pdf_catalogue_signature():
     """
-    Find the most appropriate PDF based on medication name and keywords.
-    pdf_type should be either 'leaflet' or 'pictorial'
+    Modification times of the manifest and the PDF directories. A directory's mtime
+    changes whenever a PDF is added, removed or renamed in it.
     """
-    # Convert medication name to lowercase for case-insensitive matching
-    med_name_lower = medication_name.lower()
+    signature = []
+    for path in (PDF_MANIFEST_FILE, LEAFLET_DIR, PICTORIAL_DIR):
+        try:
+            signature.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+def load_pdf_catalogue(version=0):
+    """Build a PdfCatalogue from the manifest and the PDFs currently on disk"""
+    manifest = {}
+    try:
+        with open(PDF_MANIFEST_FILE, 'r') as f:
+            manifest = json.load(f)
+    except Exception as e:
+        logger.exception("Error loading PDF manifest")
     
-    # Convert pdf_type to the correct folder name
-    pdf_folder = pdf_type + 's' if not pdf_type.endswith('s') else pdf_type
-    pdf_key = 'leaflet' if 'leaflet' in pdf_type else 'pictorial'
+    def list_pdfs(directory):
+        if not os.path.isdir(directory):
+            return set()
+        return {name for name in os.listdir(directory) if name.lower().endswith('.pdf')}
     
-    # Define keyword mappings for medications
-    keyword_mappings = {
-        'paracetamol': {
-            'tablet': {
-                'leaflet': 'paracetamoltabletsleaflet.pdf',
-                'pictorial': 'Paracetamoltabletspictorial.pdf'
-            }
-        },
-        'salbutamol': {
-            'inhaler': {
-                'leaflet': 'Salbutamolinhalerleaflet.pdf',
-                'pictorial': 'Salbutamolinhalerpictorial.pdf'
-            }
-        },
-        'peptac': {
-            'suspension': {
-                'leaflet': 'peptacliquidleaflet.pdf',
-                'pictorial': 'peptacliquidpictorial.pdf'
-            },
-            'liquid': {
-                'leaflet': 'peptacliquidleaflet.pdf',
-                'pictorial': 'peptacliquidpictorial.pdf'
-            }
-        },
-        'amlodipine': {
-            'tablet': {
-                'leaflet': 'amlodipinetabletleaflet.pdf',
-                'pictorial': 'amlodipinetabletpictorial.pdf'
-            }
-        },
-        'atorvastatin': {
-            'tablet': {
-                'leaflet': 'atorvastatintabletleaflet.pdf',
-                'pictorial': 'atorvastatintabletpictorial.pdf'
-            }
-        },
-        'carbomer': {
-            'gel': {
-                'leaflet': 'carbomerleaflet.pdf',
-                'pictorial': 'carbomerpictorial.pdf'
-            }
-        },
-        'doxycycline': {
-            'capsule': {
-                'leaflet': 'doxycyclinecapsuleleaflet.pdf',
-                'pictorial': 'doxycyclinecapsulepictorial.pdf'
-            }
-        },
-        'esomeprazole': {
-            'tablet': {
-                'leaflet': 'esomeprazoletabletleaflet.pdf',
-                'pictorial': 'esomeprazoletabletpictorial.pdf'
-            }
-        },
-        'furosemide': {
-            'tablet': {
-                'leaflet': 'furosemidetabletleaflet.pdf',
-                'pictorial': 'furosemidetabletpictorial.pdf'
-            }
-        },
-        'lisinopril': {
-            'tablet': {
-                'leaflet': 'lisinopriltabletleaflet.pdf',
-                'pictorial': 'lisinopriltabletpictorial.pdf'
-            }
-        },
-        'metformin': {
-            'm/r tablet': {
-                'leaflet': 'metforminmrtabletleaflet.pdf',
-                'pictorial': 'metforminmrtabletpictorial.pdf'
-            }
-        },
-        'mirtazapine': {
-            'tablet': {
-                'leaflet': 'mirtazapinetabletleaflet.pdf',
-                'pictorial': 'mirtazapinetabletpictorial.pdf'
-            }
-        },
-        'prednisolone': {
-            'tablet': {
-                'leaflet': 'prednisolonetabletleaflet.pdf',
-                'pictorial': 'prednisolonetabletpictorial.pdf'
-            }
-        },
-        'trimbow': {
-            'mdi': {
-                'leaflet': 'trimbowpMDIleaflet.pdf',
-                'pictorial': 'trimbowpMDIpictorial.pdf'
-            }
-        },
-        # Added new medications
-        'gtn': {
-            'spray': {
-                'leaflet': 'gtnsprayleaflet.pdf',
-                'pictorial': 'gtnspraypictorial.pdf'
-            }
-        },
-        'fludrocortisone': {
-            'tablet': {
-                'leaflet': 'fludrocortisonetabletleaflet.pdf',
-                'pictorial': 'fludrocortisonetabletpictorial.pdf'
-            }
-        },
-        'apixaban': {
-            'tablet': {
-                'leaflet': 'apixabantabletleaflet.pdf',
-                'pictorial': 'apixabantabletpictorial.pdf'
-            }
-        },
-        'loperamide': {
-            'capsule': {
-                'leaflet': 'loperamidecapsuleleaflet.pdf',
-                'pictorial': 'loperamidecapsulepictorial.pdf'
-            }
-        },
-        'amiodarone': {
-            'tablet': {
-                'leaflet': 'amiodaronetabletleaflet.pdf',
-                'pictorial': 'amiodaronetabletpictroial.pdf'  # Corrected to match actual filename
-            }
-        }
-    }
+    return PdfCatalogue(manifest, list_pdfs(LEAFLET_DIR), list_pdfs(PICTORIAL_DIR), version=version)
+
+def get_pdf_catalogue():
+    """
+    Return the current PDF catalogue, reloading it if the manifest or the PDF
+    directories have changed since it was built. The check is throttled to once
+    every PDF_CATALOGUE_CHECK_INTERVAL seconds so lookups stay cheap.
+    """
+    global pdf_catalogue, pdf_catalogue_signature, pdf_catalogue_checked_at
     
-    # Track the best match and its score
-    best_match = None
-    best_score = 0
+    now = time.monotonic()
+    if pdf_catalogue is not None and now - pdf_catalogue_checked_at < PDF_CATALOGUE_CHECK_INTERVAL:
+        return pdf_catalogue
     
+    with pdf_catalogue_lock:
+        if pdf_catalogue is not None and now - pdf_catalogue_checked_at < PDF_CATALOGUE_CHECK_INTERVAL:
+            return pdf_catalogue
+        
+        signature = get_pdf_catalogue_signature()
+        if pdf_catalogue is None or signature != pdf_catalogue_signature:
+            version = pdf_catalogue.version + 1 if pdf_catalogue is not None else 0
+            pdf_catalogue = load_pdf_catalogue(version=version)
+            pdf_catalogue_signature = signature
+            if version:
+                logger.info("Reloaded PDF catalogue with %d medications", len(pdf_catalogue.medications))
+        pdf_catalogue_checked_at = now
+        return pdf_catalogue
+
+def find_matching_pdf(medication_name, pdf_type):
+    """
+    Find the most appropriate PDF based on medication name and keywords.
+    pdf_type should be either 'leaflet' or 'pictorial'
+    """
     # Determine which type of PDF we're looking for
     pdf_key = 'leaflet' if 'leaflet' in pdf_type else 'pictorial'
     
-    # Check each medication keyword
-    for med_key, formulations in keyword_mappings.items():
-        if med_key in med_name_lower:
-            # Found a medication match, now check formulations
-            for form_key, pdf_info in formulations.items():
-                normalized_form = normalize_form(form_key)
-                # Check if any form term (or its alias) is in the med name
-                if any(alias in med_name_lower for alias in [
-                    form_key, 
-                    normalized_form, 
-                    f"{normalized_form}s", 
-                    f"{normalized_form[0:3]}", 
-                    f"{normalized_form[0:3]}s"
-                ]) or (form_key == 'tablet' and 'tab' in med_name_lower) or (form_key == 'capsule' and 'cap' in med_name_lower):
-                    # Both medication and formulation match - this is a perfect match
-                    return pdf_info[pdf_key] if pdf_key in pdf_info else None
-                else:
-                    # Only medication matches, keep track of it as a potential match
-                    # Score of 1 for medication match
-                    if 1 > best_score:
-                        best_score = 1
-                        best_match = list(formulations.values())[0][pdf_key]
-    
-    # If we found any match, return it
-    if best_match:
-        return best_match
-    
-    # No match found, return None
-    return None
+    # The matched PDF's filename, or None if no medication in the name has one
+    return get_pdf_catalogue().pdf_matchers[pdf_key].match(medication_name)
 
 def get_formatted_medication_name(med_name):
     """
     Get a properly formatted medication name with formulation details.
     """
-    med_name_lower = med_name.lower()
-    
-    # Define medication mappings with their proper names and formulations
-    medication_mappings = {
-        'salbutamol': {
-            'mdi': 'Salbutamol pMDI inhaler',
-            'inhaler': 'Salbutamol pMDI inhaler',
-        },
-        'trimbow': {
-            'pMDI': 'Trimbow pMDI inhaler',
-            'inhaler': 'Trimbow pMDI inhaler'
-        },
-        'doxycycline': {
-            'capsule': 'Doxycycline capsules',
-        },
-        'esomeprazole': {
-            'tablet': 'Esomeprazole tablets',
-        },
-        'furosemide': {
-            'tablet': 'Furosemide tablets',
-        },
-        'lisinopril': {
-            'tablet': 'Lisinopril tablets'
-        },
-        'metformin': {
-            'm/r tablet': 'Metformin modified-release tablets',
-        },
-        'mirtazapine': {
-            'tablet': 'Mirtazapine tablets',
-        },
-        'prednisolone': {
-            'tablet': 'Prednisolone tablets',
-        },
-        'paracetamol': {
-            'tablet': 'Paracetamol tablets',
-        },
-        'peptac': {
-            'suspension': 'Peptac liquid',
-            'liquid': 'Peptac liquid'
-        },
-        'amlodipine': {
-            'tablet': 'Amlodipine tablets'
-        },
-        'atorvastatin': {
-            'tablet': 'Atorvastatin tablets'
-        },
-        'carbomer': {
-            'gel': 'Carbomer eye gel'
-        },
-        # Added new medications
-        'gtn': {
-            'spray': 'GTN spray'
-        },
-        'fludrocortisone': {
-            'tablet': 'Fludrocortisone tablets'
-        },
-        'apixaban': {
-            'tablet': 'Apixaban tablets'
-        },
-        'loperamide': {
-            'capsule': 'Loperamide capsules'
-        },
-        'amiodarone': {
-            'tablet': 'Amiodarone tablets'
-        }
-    }
+    formatted_name = get_pdf_catalogue().display_matcher.match(med_name)
     
-    # Find the medication in our mappings
-    for med_key, formulations in medication_mappings.items():
-        if med_key in med_name_lower:
-            # Found a medication match, now check formulations
-            for form_key, formatted_name in formulations.items():
-                normalized_form = normalize_form(form_key)
-                # Check for form aliases
-                if any(alias in med_name_lower for alias in [
-                    form_key, 
-                    normalized_form, 
-                    f"{normalized_form}s", 
-                    f"{normalized_form[0:3]}", 
-                    f"{normalized_form[0:3]}s"
-                ]):
-                    # Both medication and formulation match
-                    return formatted_name
-            
-            # If no formulation match but medication matches, return the first formulation
-            if formulations:
-                return list(formulations.values())[0]
+    # Names with no known medication are shown as they are
+    return formatted_name or med_name
+
+def get_pdf_availability(name, formulation):
+    """
+    Get the pdfAvailable/pdfLeafletAvailable/pdfPictorialAvailable flags and
+    matched filenames for a medication
+    """
+    # Try with both combined name and individual components
+    med_name = f"{name} {formulation}"
+    pdf_leaflet = find_matching_pdf(med_name, 'leaflet')
+    pdf_pictorial = find_matching_pdf(med_name, 'pictorial')
+    
+    # If not found, try with just the medication name
+    if pdf_leaflet is None and pdf_pictorial is None:
+        pdf_leaflet = find_matching_pdf(name, 'leaflet')
+        pdf_pictorial = find_matching_pdf(name, 'pictorial')
     
-    # If no match found, return the original name
-    return med_name
+    availability = {
+        'pdfAvailable': (pdf_leaflet is not None) or (pdf_pictorial is not None),
+        'pdfLeafletAvailable': pdf_leaflet is not None,
+        'pdfPictorialAvailable': pdf_pictorial is not None
+    }
+    if pdf_leaflet:
+        availability['pdfLeafletFilename'] = pdf_leaflet
+    if pdf_pictorial:
+        availability['pdfPictorialFilename'] = pdf_pictorial
+    return availability
+
+# Medication list with PDF availability flags, computed once per catalogue version
+all_medications_cache = (None, [])
 
 def get_all_medications():
     """
     Get a list of all available medications with their formulations.
+    The list is shared between requests and must not be modified by callers.
     """
-    medications = [
-        {'name': 'Salbutamol', 'formulation': 'pMDI inhaler'},
-        {'name': 'Trimbow', 'formulation': 'pMDI inhaler'},
-        {'name': 'Doxycycline', 'formulation': 'capsules'},
-        {'name': 'Esomeprazole', 'formulation': 'tablets'},
-        {'name': 'Furosemide', 'formulation': 'tablets'},
-        {'name': 'Lisinopril', 'formulation': 'tablets'},
-        {'name': 'Metformin', 'formulation': 'M/R tablets'},
-        {'name': 'Mirtazapine', 'formulation': 'tablets'},
-        {'name': 'Prednisolone', 'formulation': 'tablets'},
-        {'name': 'Paracetamol', 'formulation': 'tablets'},
-        {'name': 'Peptac', 'formulation': 'liquid'},
-        {'name': 'Amlodipine', 'formulation': 'tablets'},
-        {'name': 'Atorvastatin', 'formulation': 'tablets'},
-        {'name': 'Carbomer', 'formulation': 'eye gel'},
-        # Added new medications
-        {'name': 'GTN', 'formulation': 'spray'},
-        {'name': 'Fludrocortisone', 'formulation': 'tablets'},
-        {'name': 'Apixaban', 'formulation': 'tablets'},
-        {'name': 'Loperamide', 'formulation': 'capsules'},
-        {'name': 'Amiodarone', 'formulation': 'tablets'}
-    ]
+    global all_medications_cache
+    
+    catalogue = get_pdf_catalogue()
+    cached_version, cached_medications = all_medications_cache
+    if cached_version == catalogue.version:
+        return cached_medications
+    
+    medications = [dict(med) for med in catalogue.medications]
     
     # Add PDF availability information
     for med in medications:
-        # Try with both combined name and individual components
-        med_name = f"{med['name']} {med['formulation']}"
-        pdf_leaflet = find_matching_pdf(med_name, 'leaflet')
-        pdf_pictorial = find_matching_pdf(med_name, 'pictorial')
-        
-        # If not found, try with just the medication name
-        if pdf_leaflet is None and pdf_pictorial is None:
-            pdf_leaflet = find_matching_pdf(med['name'], 'leaflet')
-            pdf_pictorial = find_matching_pdf(med['name'], 'pictorial')
-            
-        # Print debug info
-        print(f"Checking: {med_name}")
-        print(f"  Leaflet: {pdf_leaflet}")
-        print(f"  Pictorial: {pdf_pictorial}")
-        
-        med['pdfAvailable'] = (pdf_leaflet is not None) or (pdf_pictorial is not None)
-        med['pdfLeafletAvailable'] = pdf_leaflet is not None
-        med['pdfPictorialAvailable'] = pdf_pictorial is not None
-        
-        if pdf_leaflet:
-            med['pdfLeafletFilename'] = pdf_leaflet
-        if pdf_pictorial:
-            med['pdfPictorialFilename'] = pdf_pictorial
+        med.update(get_pdf_availability(med['name'], med['formulation']))
     
+    all_medications_cache = (catalogue.version, medications)
     return medications
 
 @app.route('/generate_leaflet', methods=['POST'])
@@ -561,22 +832,18 @@ def generate_leaflet():
     
     # If we found at least one PDF, merge them and return the merged PDF
     if pdf_files:
-        # Create a unique filename for the merged PDF
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        merged_filename = f'merged_leaflets_{timestamp}.pdf'
-        merged_filepath = os.path.join(app.root_path, 'static', 'temp', merged_filename)
-        
-        # Create the temp directory if it doesn't exist
-        os.makedirs(os.path.join(app.root_path, 'static', 'temp'), exist_ok=True)
+        # Optionally stream the merged PDF back in this response instead of returning a path
+        if request_wants_pdf_stream(data):
+            return stream_merged_pdf(pdf_files, 'merged_leaflets.pdf')
         
-        # Merge the PDFs
-        merge_pdfs(pdf_files, merged_filepath)
+        # Reuse a previously merged copy of the same leaflet set if we have one
+        merged_filename = get_or_create_merged_pdf(pdf_files)
         
         # Return the path to the merged PDF
         return jsonify({
             'status': 'success',
             'type': 'pdf',
-            'pdf_path': f'/static/temp/{merged_filename}',
+            'pdf_path': f'/static/pdf_cache/{merged_filename}',
             'not_found_medications': not_found_medications
         })
     
@@ -701,22 +968,18 @@ def generate_pictorial():
     
     # If we found at least one PDF, merge them and return the merged PDF
     if pdf_files:
-        # Create a unique filename for the merged PDF
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        merged_filename = f'merged_pictorials_{timestamp}.pdf'
-        merged_filepath = os.path.join(app.root_path, 'static', 'temp', merged_filename)
+        # Optionally stream the merged PDF back in this response instead of returning a path
+        if request_wants_pdf_stream(data):
+            return stream_merged_pdf(pdf_files, 'merged_pictorials.pdf')
         
-        # Create the temp directory if it doesn't exist
-        os.makedirs(os.path.join(app.root_path, 'static', 'temp'), exist_ok=True)
-        
-        # Merge the PDFs
-        merge_pdfs(pdf_files, merged_filepath)
+        # Reuse a previously merged copy of the same pictorial set if we have one
+        merged_filename = get_or_create_merged_pdf(pdf_files)
         
         # Return the path to the merged PDF
         return jsonify({
             'status': 'success',
             'type': 'pdf',
-            'pdf_path': f'/static/temp/{merged_filename}',
+            'pdf_path': f'/static/pdf_cache/{merged_filename}',
             'not_found_medications': not_found_medications
         })
     
@@ -839,26 +1102,383 @@ def medications_list_check(medication_names):
     return medication_names and isinstance(medication_names, list) and len(medication_names) > 0
 
 
+# Maximum number of parsed source PDFs kept in memory by the reader pool
+PDF_READER_POOL_SIZE = int(os.environ.get('PDF_READER_POOL_SIZE', 64))
+
+# Parsed PdfReader objects keyed by file path, most recently used last.
+# Each entry is (mtime_ns, reader) so a leaflet replaced on disk is re-parsed.
+pdf_reader_pool = OrderedDict()
+pdf_reader_pool_lock = threading.RLock()
+
+def get_pooled_pdf_reader(pdf_file):
+    """
+    Return a parsed PdfReader for pdf_file, parsing it only on first use or after the
+    file has changed on disk. Callers must hold pdf_reader_pool_lock while using the
+    reader, since PyPDF2 resolves objects lazily from the shared stream.
+    """
+    mtime_ns = os.stat(pdf_file).st_mtime_ns
+    
+    with pdf_reader_pool_lock:
+        cached = pdf_reader_pool.get(pdf_file)
+        if cached and cached[0] == mtime_ns:
+            pdf_reader_pool.move_to_end(pdf_file)
+            return cached[1]
+        
+        # Read the whole file into memory so the pool doesn't hold file handles open
+        with open(pdf_file, 'rb') as f:
+            reader = PyPDF2.PdfReader(io.BytesIO(f.read()))
+        # Resolve the page tree up front so merges only copy already-parsed pages
+        for page in reader.pages:
+            page.get_contents()
+        
+        pdf_reader_pool[pdf_file] = (mtime_ns, reader)
+        pdf_reader_pool.move_to_end(pdf_file)
+        while len(pdf_reader_pool) > PDF_READER_POOL_SIZE:
+            pdf_reader_pool.popitem(last=False)
+        return reader
+
 def merge_pdfs(pdf_files, output_path):
     """
-    Merge multiple PDF files into a single PDF file
+    Merge multiple PDF files into a single PDF file.
+    output_path may be a file path or a writable binary file-like object.
     """
-    merger = PyPDF2.PdfMerger()
+    writer = PyPDF2.PdfWriter()
     
-    for pdf_file in pdf_files:
-        merger.append(pdf_file)
+    # add_page() copies each page's objects into the writer, so only this part reads the
+    # shared readers; the (slow) write below runs without blocking other merges
+    with pdf_reader_pool_lock:
+        for pdf_file in pdf_files:
+            for page in get_pooled_pdf_reader(pdf_file).pages:
+                writer.add_page(page)
     
-    merger.write(output_path)
-    merger.close()
+    writer.write(output_path)
+    writer.close()
     
     return output_path
 
 
+# Directory for storing merged leaflet/pictorial packs, keyed by their contents
+PDF_CACHE_DIR = os.path.join(app.static_folder, 'pdf_cache')
+os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+
+# Eviction limits for the merged PDF cache (overridable from the environment)
+PDF_CACHE_MAX_BYTES = int(os.environ.get('PDF_CACHE_MAX_MB', 200)) * 1024 * 1024
+PDF_CACHE_MAX_AGE_HOURS = float(os.environ.get('PDF_CACHE_MAX_AGE_HOURS', 24 * 7))
+
+# Browser cache lifetime (seconds) for merged PDFs streamed directly in the response
+PDF_STREAM_MAX_AGE = int(os.environ.get('PDF_STREAM_MAX_AGE', 3600))
+
+# Hit/miss counters for the merged PDF cache, exposed via /pdf_cache_stats
+pdf_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+pdf_cache_lock = threading.Lock()
+
+def get_merged_pdf_cache_key(pdf_files):
+    """
+    Build a cache key from the ordered list of source PDFs and their modification times,
+    so that replacing a leaflet on disk automatically invalidates any pack containing it
+    """
+    hash_obj = hashlib.sha256()
+    for pdf_file in pdf_files:
+        relative_path = os.path.relpath(pdf_file, app.static_folder)
+        hash_obj.update(f"{relative_path}:{os.stat(pdf_file).st_mtime_ns}\n".encode('utf-8'))
+    return hash_obj.hexdigest()
+
+def get_or_create_merged_pdf(pdf_files, pdf_bytes=None):
+    """
+    Return the filename (inside PDF_CACHE_DIR) of the merged PDF for the given source files,
+    merging them only if an identical pack is not already cached. If pdf_bytes is given it
+    is stored as the merged PDF instead of merging again.
+    """
+    merged_filename = f"{get_merged_pdf_cache_key(pdf_files)}.pdf"
+    merged_filepath = os.path.join(PDF_CACHE_DIR, merged_filename)
+    
+    if pdf_bytes is None and os.path.exists(merged_filepath):
+        with pdf_cache_lock:
+            pdf_cache_stats['hits'] += 1
+        mark_used(merged_filepath)
+        return merged_filename
+    
+    if pdf_bytes is None:
+        with pdf_cache_lock:
+            pdf_cache_stats['misses'] += 1
+    
+    # Concurrent requests for the same pack never see a half-written PDF
+    def write_pack(tmp_path):
+        with open(tmp_path, 'wb') as f:
+            if pdf_bytes is None:
+                merge_pdfs(pdf_files, f)
+            else:
+                f.write(pdf_bytes)
+    
+    write_file_atomically(merged_filepath, write_pack)
+    
+    evict_pdf_cache(keep=merged_filepath)
+    return merged_filename
+
+def request_wants_pdf_stream(data):
+    """
+    Check whether the client asked for the merged PDF in the response body,
+    either with "stream": true in the JSON payload or ?stream=1 in the URL
+    """
+    if data.get('stream') is True:
+        return True
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+def stream_merged_pdf(pdf_files, download_name):
+    """
+    Return the merged PDF for pdf_files directly in the response, from the merged PDF
+    cache if possible or from an in-memory merge otherwise. The response is sent with
+    its Content-Length and a private Cache-Control, so shared caches don't keep it.
+    """
+    cache_key = get_merged_pdf_cache_key(pdf_files)
+    merged_filepath = os.path.join(PDF_CACHE_DIR, f"{cache_key}.pdf")
+    
+    if os.path.exists(merged_filepath):
+        with pdf_cache_lock:
+            pdf_cache_stats['hits'] += 1
+        mark_used(merged_filepath)
+        response = send_file(merged_filepath, mimetype='application/pdf', download_name=download_name,
+                             etag=False, max_age=PDF_STREAM_MAX_AGE, conditional=False)
+        response.cache_control.public = False
+        response.cache_control.private = True
+        return response
+    
+    with pdf_cache_lock:
+        pdf_cache_stats['misses'] += 1
+    
+    buffer = io.BytesIO()
+    merge_pdfs(pdf_files, buffer)
+    pdf_bytes = buffer.getvalue()
+    
+    # Keep a copy in the merged PDF cache so repeat packs skip the merge
+    get_or_create_merged_pdf(pdf_files, pdf_bytes=pdf_bytes)
+    
+    response = Response(pdf_bytes, mimetype='application/pdf')
+    response.content_length = len(pdf_bytes)
+    response.headers['Content-Disposition'] = f'inline; filename="{download_name}"'
+    response.cache_control.private = True
+    response.cache_control.max_age = PDF_STREAM_MAX_AGE
+    return response
+
+def evict_pdf_cache(max_bytes=None, max_age_hours=None, keep=None):
+    """
+    Delete cached merged PDFs older than max_age_hours, then delete the least recently
+    used entries until the cache fits in max_bytes. The file at `keep` (the pack that is
+    about to be served) is never deleted. Returns the number of files deleted.
+    """
+    max_bytes = PDF_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    max_age_hours = PDF_CACHE_MAX_AGE_HOURS if max_age_hours is None else max_age_hours
+    
+    count = evict_lru_files(PDF_CACHE_DIR, '.pdf', max_bytes, max_age=max_age_hours * 3600, keep=keep)
+    if count:
+        with pdf_cache_lock:
+            pdf_cache_stats['evictions'] += count
+    return count
+
+@app.route('/pdf_cache_stats')
+def pdf_cache_stats_route():
+    """Report merged PDF cache usage so the cache limits can be sized"""
+    entries = [entry.stat().st_size for entry in os.scandir(PDF_CACHE_DIR)
+               if entry.is_file() and entry.name.endswith('.pdf')]
+    with pdf_cache_lock:
+        stats = dict(pdf_cache_stats)
+    lookups = stats['hits'] + stats['misses']
+    
+    return jsonify({
+        'status': 'success',
+        'hits': stats['hits'],
+        'misses': stats['misses'],
+        'evictions': stats['evictions'],
+        'hit_rate': stats['hits'] / lookups if lookups else 0.0,
+        'entries': len(entries),
+        'size_bytes': sum(entries),
+        'max_bytes': PDF_CACHE_MAX_BYTES,
+        'max_age_hours': PDF_CACHE_MAX_AGE_HOURS
+    })
+
+
+# Formulary files used for server-side medication search
+DRUG_ALIASES_FILE = os.path.join(app.static_folder, 'drug_aliases.json')
+DRUG_FORMULATIONS_FILE = os.path.join(app.static_folder, 'drug_formulations.json')
+
+# Default and maximum number of results returned by /search_medications
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+# Minimum trigram similarity for a fuzzy (misspelt) search match
+SEARCH_FUZZY_THRESHOLD = 0.4
+
+# Ranking tiers for search matches, best first
+SEARCH_EXACT, SEARCH_PREFIX, SEARCH_WORD_PREFIX, SEARCH_SUBSTRING, SEARCH_FUZZY = range(5)
+
+def get_trigrams(term):
+    """Get the set of trigrams of a term, padded so that short terms and prefixes still have some"""
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class MedicationSearchIndex:
+    """
+    Search index over the PDF catalogue and the full formulary in drug_aliases.json.
+    Brand names and other aliases resolve to their generic medication. Matches are
+    ranked exact > prefix > word prefix > substring > fuzzy, and within a tier
+    medications with a leaflet or pictorial come first.
+    """
+    def __init__(self, catalogue_medications, drug_aliases, drug_formulations):
+        self.documents = []
+        self.terms = {}
+        
+        # Formulations by drug name, and by first word for salts like "Abiraterone Acetate"
+        formulations_by_name = {}
+        for entry in drug_formulations:
+            for name in entry.get('name', []):
+                name = name.lower().strip()
+                for key in (name, name.split(' ')[0]):
+                    forms = formulations_by_name.setdefault(key, [])
+                    forms.extend(form for form in entry.get('formulation', []) if form not in forms)
+        
+        # Medications from the PDF catalogue come first and keep their availability flags
+        catalogue_docs = {}
+        for med in catalogue_medications:
+            doc_id = self.add_document(dict(med), med['name'])
+            self.add_term(med['formulation'], doc_id, substring_only=True)
+            catalogue_docs[med['name'].lower()] = doc_id
+        catalogue_keys = {}
+        for med_key, doc_id in catalogue_docs.items():
+            catalogue_keys[med_key] = doc_id
+            catalogue_keys[med_key.split(' ')[0]] = doc_id
+        
+        for entry in drug_aliases:
+            aliases = [alias.lower().strip() for alias in [entry['name']] + entry.get('aliases', [])]
+            
+            # Attach aliases to the catalogue medication they describe, e.g. "ventolin" -> Salbutamol
+            doc_id = next((catalogue_keys[alias] for alias in aliases if alias in catalogue_keys), None)
+            if doc_id is None:
+                forms = next((formulations_by_name[alias] for alias in aliases if alias in formulations_by_name), [])
+                med = {'name': entry['name'], 'formulation': forms[0] if forms else ''}
+                if forms:
+                    med['formulations'] = forms
+                med.update(get_pdf_availability(med['name'], med['formulation']))
+                doc_id = self.add_document(med, entry['name'])
+            
+            for alias in aliases:
+                self.add_term(alias, doc_id)
+        
+        # Sorted term list for prefix lookups and a trigram index for substring/fuzzy lookups
+        self.sorted_terms = sorted(self.terms)
+        self.word_index = {}
+        self.trigram_index = {}
+        for term in self.terms:
+            for word in term.replace('/', ' ').split()[1:]:
+                self.word_index.setdefault(word, set()).add(term)
+            for trigram in get_trigrams(term):
+                self.trigram_index.setdefault(trigram, set()).add(term)
+        self.sorted_words = sorted(self.word_index)
+    
+    def add_document(self, med, name):
+        self.documents.append((med, name.lower()))
+        return len(self.documents) - 1
+    
+    def add_term(self, term, doc_id, substring_only=False):
+        term = term.lower().strip()
+        if term:
+            # Each term maps to {doc_id: substring_only}; a full term beats a substring-only one
+            postings = self.terms.setdefault(term, {})
+            postings[doc_id] = postings.get(doc_id, True) and substring_only
+    
+    def prefix_range(self, sorted_list, prefix):
+        start = bisect.bisect_left(sorted_list, prefix)
+        end = bisect.bisect_left(sorted_list, prefix + '\uffff', start)
+        return sorted_list[start:end]
+    
+    def search(self, query, limit=SEARCH_DEFAULT_LIMIT):
+        """Return up to limit ranked medication dicts matching query"""
+        query = query.lower().strip()
+        best = {}
+        
+        def collect(terms, tier, similarity=1.0):
+            for term in terms:
+                for doc_id, substring_only in self.terms[term].items():
+                    match_tier = max(tier, SEARCH_SUBSTRING) if substring_only else tier
+                    rank = (match_tier, -similarity)
+                    if doc_id not in best or rank < best[doc_id][0]:
+                        best[doc_id] = (rank, term)
+        
+        if query in self.terms:
+            collect([query], SEARCH_EXACT)
+        collect(self.prefix_range(self.sorted_terms, query), SEARCH_PREFIX)
+        for word in self.prefix_range(self.sorted_words, query):
+            collect(self.word_index[word], SEARCH_WORD_PREFIX)
+        
+        # Substring and fuzzy matches only fill in when the better tiers run short
+        if len(best) < limit and len(query) >= 3:
+            query_trigrams = get_trigrams(query)
+            inner_trigrams = sorted((self.trigram_index.get(trigram, set()) for trigram in
+                                     {query[i:i + 3] for i in range(len(query) - 2)}), key=len)
+            candidates = set.intersection(*inner_trigrams) if inner_trigrams else set()
+            collect((term for term in candidates if query in term), SEARCH_SUBSTRING)
+            
+            # Fuzzy matching is only for misspellings, so skip it once anything matched
+            if not best and len(query) >= 4:
+                shared = {}
+                for trigram in query_trigrams:
+                    for term in self.trigram_index.get(trigram, ()):
+                        shared[term] = shared.get(term, 0) + 1
+                for term, count in shared.items():
+                    similarity = 2.0 * count / (len(query_trigrams) + len(term) + 1)
+                    if similarity >= SEARCH_FUZZY_THRESHOLD:
+                        collect([term], SEARCH_FUZZY, similarity)
+        
+        def sort_key(doc_id):
+            med, name = self.documents[doc_id]
+            return (best[doc_id][0], not med.get('pdfAvailable'), len(name), name)
+        
+        results = []
+        for doc_id in sorted(best, key=sort_key)[:limit]:
+            med, name = self.documents[doc_id]
+            result = dict(med)
+            matched_term = best[doc_id][1]
+            # Show which brand name or alias matched when it isn't the medication's own name
+            if matched_term != name and best[doc_id][0][0] < SEARCH_SUBSTRING and not name.startswith(query):
+                result['matchedAlias'] = matched_term
+            results.append(result)
+        return results
+
+# Search index, rebuilt whenever the PDF catalogue changes
+medication_search_index_cache = (None, None)
+
+def load_search_formulary():
+    """Load the drug alias and formulation lists used by the search index"""
+    formulary = []
+    for path in (DRUG_ALIASES_FILE, DRUG_FORMULATIONS_FILE):
+        try:
+            with open(path, 'r') as f:
+                formulary.append(json.load(f))
+        except Exception as e:
+            logger.exception("Error loading %s", path)
+            formulary.append([])
+    return formulary
+
+search_formulary = load_search_formulary()
+
+def get_medication_search_index():
+    """Return the medication search index for the current PDF catalogue"""
+    global medication_search_index_cache
+    
+    catalogue = get_pdf_catalogue()
+    cached_version, index = medication_search_index_cache
+    if cached_version != catalogue.version:
+        index = MedicationSearchIndex(get_all_medications(), *search_formulary)
+        medication_search_index_cache = (catalogue.version, index)
+    return index
+
+# Build the search index at startup rather than on the first keystroke
+get_medication_search_index()
+
 @app.route('/search_medications', methods=['POST'])
 def search_medications():
     """
     Search for medications based on a search term.
-    Returns a list of matching medications with their formulations.
+    Returns a ranked list of matching medications with their formulations.
     """
     data = request.json
     search_term = data.get('searchTerm', '').lower()
@@ -869,14 +1489,12 @@ def search_medications():
             'message': 'Search term must be at least 2 characters long'
         })
     
-    # Get all medications
-    all_medications = get_all_medications()
+    try:
+        limit = min(max(int(data.get('limit', SEARCH_DEFAULT_LIMIT)), 1), SEARCH_MAX_LIMIT)
+    except (TypeError, ValueError):
+        limit = SEARCH_DEFAULT_LIMIT
     
-    # Filter medications based on search term
-    matching_medications = []
-    for med in all_medications:
-        if search_term in med['name'].lower() or search_term in med['formulation'].lower():
-            matching_medications.append(med)
+    matching_medications = get_medication_search_index().search(search_term, limit)
     
     return jsonify({
         'status': 'success',
@@ -915,6 +1533,171 @@ def get_medication_details():
     })
 
 
+# Formulary files used to enrich medications extracted from discharge letters
+FORMULATION_ALIASES_FILE = os.path.join(app.static_folder, 'formulation_aliases.json')
+BNF_LABELS_FILE = os.path.join(app.static_folder, 'bnf_labels.json')
+
+# Maximum number of letters accepted by a single /extract_medications request
+EXTRACT_MAX_LETTERS = int(os.environ.get('EXTRACT_MAX_LETTERS', 500))
+
+MATCH_TEXT_SEPARATORS = re.compile(r'[^a-z0-9/]+')
+
+def normalize_match_text(text):
+    """
+    Lowercase text and turn punctuation other than '/' into single spaces, padded with
+    spaces so that matching ' alias ' as a substring only matches whole words
+    """
+    return ' ' + ' '.join(MATCH_TEXT_SEPARATORS.sub(' ', text.lower()).split()) + ' '
+
+class MedicationLabelIndex:
+    """
+    Resolves brand names and other aliases to generic drug names, and generic
+    drug name plus formulation to BNF cautionary and advisory labels
+    """
+    def __init__(self, drug_aliases, drug_formulations, formulation_aliases, bnf_labels):
+        # Whole-word alias -> generic name
+        self.generic_names = {}
+        for entry in drug_aliases:
+            for alias in [entry['name']] + entry.get('aliases', []):
+                key = normalize_match_text(alias)
+                if key.strip():
+                    self.generic_names.setdefault(key, entry['name'])
+        self.drug_automaton = KeywordAutomaton(self.generic_names)
+        
+        # Whole-word formulation alias -> route/category, e.g. "oral/solid/modified_release"
+        self.form_categories = {}
+        def add_form_aliases(path, node):
+            if isinstance(node, list):
+                for alias in node:
+                    self.form_categories.setdefault(normalize_match_text(alias), path)
+            else:
+                for key, child in node.items():
+                    add_form_aliases(f"{path}/{key}" if path else key, child)
+        add_form_aliases('', formulation_aliases.get('formulations', {}))
+        self.form_automaton = KeywordAutomaton(self.form_categories)
+        
+        self.label_texts = {label['label_number']: label['text']
+                            for label in bnf_labels.get('cautionary_advisory_labels', [])}
+        
+        # Lowercase drug name -> [(formulation category, formulation, label numbers)],
+        # also indexed by first word so "Abiraterone" finds "Abiraterone Acetate"
+        self.formulations_by_drug = {}
+        first_word_formulations = {}
+        for entry in drug_formulations:
+            for name in entry.get('name', []):
+                name = name.lower().strip()
+                for formulation in entry.get('formulation', []):
+                    item = (self.get_form_category(formulation), formulation, entry.get('label_number', []))
+                    self.formulations_by_drug.setdefault(name, []).append(item)
+                    first_word_formulations.setdefault(name.split(' ')[0], []).append(item)
+        for name, items in first_word_formulations.items():
+            self.formulations_by_drug.setdefault(name, items)
+    
+    def find_longest(self, automaton, text):
+        found = automaton.find_all(normalize_match_text(text))
+        return max(found, key=len) if found else None
+    
+    def resolve_generic_name(self, text):
+        """Get the generic name of the longest drug name or alias mentioned in text"""
+        key = self.find_longest(self.drug_automaton, text)
+        return self.generic_names[key] if key else None
+    
+    def get_form_category(self, text):
+        """Get the formulation category of the longest formulation alias mentioned in text"""
+        key = self.find_longest(self.form_automaton, text)
+        return self.form_categories[key] if key else None
+    
+    def get_labels(self, generic_name, dosage):
+        """
+        Get (formulation, label numbers) for a drug in the formulation described by dosage.
+        Labels are only returned when the formulation matches, or when every formulation
+        of the drug carries the same labels.
+        """
+        candidates = self.formulations_by_drug.get((generic_name or '').lower(), [])
+        if not candidates:
+            return None, []
+        
+        category = self.get_form_category(dosage)
+        for form_category, formulation, labels in candidates:
+            if category and form_category == category:
+                return formulation, labels
+        
+        if all(labels == candidates[0][2] for _, _, labels in candidates):
+            return None, candidates[0][2]
+        return None, []
+
+def load_medication_label_index():
+    """Build the MedicationLabelIndex from the bundled formulary files"""
+    extra_data = []
+    for path in (FORMULATION_ALIASES_FILE, BNF_LABELS_FILE):
+        try:
+            with open(path, 'r') as f:
+                extra_data.append(json.load(f))
+        except Exception as e:
+            logger.exception("Error loading %s", path)
+            extra_data.append({})
+    return MedicationLabelIndex(search_formulary[0], search_formulary[1], *extra_data)
+
+medication_label_index = load_medication_label_index()
+
+@lru_cache(maxsize=4096)
+def get_medication_enrichment(name, dosage, form, catalogue_version):
+    """
+    Get the generic name, matched PDFs and BNF labels for an extracted medication.
+    Cached because the same medications recur across letters; catalogue_version is
+    part of the key so PDF matches are refreshed when the catalogue changes.
+    """
+    # The bracketed product description names the actual product, so try it first
+    generic_name = (medication_label_index.resolve_generic_name(dosage)
+                    or medication_label_index.resolve_generic_name(name))
+    
+    availability = get_pdf_availability(name, form or '')
+    if not availability['pdfAvailable'] and generic_name:
+        availability = get_pdf_availability(generic_name, form or '')
+    
+    label_formulation, label_numbers = medication_label_index.get_labels(generic_name, dosage)
+    bnf_labels = [{'number': number, 'text': medication_label_index.label_texts.get(number, '')}
+                  for number in label_numbers]
+    
+    return dict(availability, genericName=generic_name, bnfLabelFormulation=label_formulation,
+                bnfLabels=bnf_labels)
+
+def extract_and_enrich_medications(letter):
+    """Extract the discharge medications from a letter and add matched PDFs and BNF labels"""
+    catalogue_version = get_pdf_catalogue().version
+    medications = extract_medications_from_discharge_letter(letter)
+    for med in medications:
+        med.update(get_medication_enrichment(med['name'], med['dosage'], med['form'], catalogue_version))
+    return medications
+
+@app.route('/extract_medications', methods=['POST'])
+def extract_medications():
+    """
+    Extract structured medications from discharge letters.
+    Accepts {"letter": "..."} for one letter or {"letters": ["...", ...]} for a batch.
+    """
+    data = request.json or {}
+    letters = data.get('letters')
+    if letters is None and 'letter' in data:
+        letters = [data['letter']]
+    
+    if not letters or not isinstance(letters, list) or not all(isinstance(letter, str) for letter in letters):
+        return jsonify({'status': 'error', 'message': 'Provide a letter string or a list of letters'}), 400
+    if len(letters) > EXTRACT_MAX_LETTERS:
+        return jsonify({'status': 'error', 'message': f'At most {EXTRACT_MAX_LETTERS} letters per request'}), 400
+    
+    results = []
+    for letter in letters:
+        medications = extract_and_enrich_medications(letter)
+        results.append({'count': len(medications), 'medications': medications})
+    
+    return jsonify({
+        'status': 'success',
+        'letters': len(results),
+        'results': results
+    })
+
+
 # Generate a unique ID for an instruction
 def generate_instruction_id(instruction):
     # Create a hash of the instruction to use as a unique identifier
@@ -931,8 +1714,13 @@ def ensure_instruction_pages():
         if not instructions_data:
             return jsonify({'status': 'error', 'message': 'No instructions provided'})
         
+        # Pick up instructions saved by other workers before deciding what is new
+        sync_instruction_texts()
+        
         results = []
+        new_instructions = {}
         
+        pages = []
         for item in instructions_data:
             medication_name = item.get('medication_name', '')
             instruction = item.get('instruction', '')
@@ -944,60 +1732,21 @@ def ensure_instruction_pages():
             # Check if instruction ID matches what we would generate
             generated_id = generate_instruction_id(instruction)
             if generated_id != instruction_id:
-                print(f"Warning: Instruction ID mismatch for {medication_name}")
+                logger.warning("Instruction ID mismatch for %s", medication_name)
                 instruction_id = generated_id
             
-            # Create QR code that points to the instruction page
-            qr_url = url_for('instruction_page', instruction_id=instruction_id, _external=True)
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(qr_url)
-            qr.make(fit=True)
-            
-            # Create QR code image
-            qr_img = qr.make_image(fill_color="black", back_color="white")
-            
-            # Add medication name as text below QR code if provided
-            if medication_name:
-                # Create a new image with space for text
-                img_width, img_height = qr_img.size
-                new_img = Image.new('RGB', (img_width, img_height + 40), 'white')
-                new_img.paste(qr_img, (0, 0))
-                
-                # Add text
-                draw = ImageDraw.Draw(new_img)
-                try:
-                    font = ImageFont.truetype("Arial", 16)
-                except IOError:
-                    font = ImageFont.load_default()
-                    
-                # Draw medication name centered below QR code
-                text_width = draw.textlength(medication_name, font=font)
-                draw.text(((img_width - text_width) // 2, img_height + 10), medication_name, fill="black", font=font)
-                qr_img = new_img
-            
-            # Save QR code image
-            qr_filename = f"{instruction_id}.png"
-            qr_path = os.path.join(QR_DIR, qr_filename)
-            qr_img.save(qr_path)
-            
-            # Generate audio file if it doesn't exist
-            audio_filename = f"{instruction_id}.mp3"
-            audio_path = os.path.join(AUDIO_DIR, audio_filename)
-            
-            if not os.path.exists(audio_path):
-                # Create the audio file with gTTS
-                spoken_text = f"For {medication_name}: {instruction}" if medication_name else instruction
-                tts = gTTS(text=spoken_text, lang='en')
-                tts.save(audio_path)
+            pages.append((instruction_id, medication_name, instruction))
+        
+        # Render QR codes that point to the instruction pages, labelled with the medication name
+        prerender_qr_images([(instruction_id, medication_name) for instruction_id, medication_name, _ in pages])
+        
+        for instruction_id, medication_name, instruction in pages:
+            # Queue the audio the instruction page will play, unless it is already cached
+            audio_status, _ = queue_instruction_audio({'text': instruction, 'medication_name': medication_name})
             
             # Store the instruction text for this ID if it's not already stored
             if instruction_id not in instruction_texts:
-                instruction_texts[instruction_id] = {
+                new_instructions[instruction_id] = {
                     'text': instruction,
                     'medication_name': medication_name
                 }
@@ -1005,11 +1754,13 @@ def ensure_instruction_pages():
             results.append({
                 'instruction_id': instruction_id,
                 'qr_generated': True,
-                'audio_generated': not os.path.exists(audio_path)
+                'audio_generated': audio_status == 'ready',
+                'audio_status': audio_status
             })
         
-        # Save the updated instruction data to file
-        save_instruction_data()
+        # Save only the new instructions to the instruction store
+        if new_instructions:
+            save_instructions(new_instructions)
         
         return jsonify({
             'status': 'success',
@@ -1034,135 +1785,204 @@ def generate_qr_code():
         # Generate a unique ID for this instruction
         instruction_id = generate_instruction_id(instruction)
         
-        # Create QR code that points to the instruction page
-        qr_url = url_for('instruction_page', instruction_id=instruction_id, _external=True)
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(qr_url)
-        qr.make(fit=True)
-        
-        # Create QR code image
-        qr_img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Add medication name as text below QR code
-        if medication_name:
-            # Create a new image with space for text
-            img_width, img_height = qr_img.size
-            new_img = Image.new('RGB', (img_width, img_height + 40), 'white')
-            new_img.paste(qr_img, (0, 0))
-            
-            # Add text
-            draw = ImageDraw.Draw(new_img)
-            try:
-                font = ImageFont.truetype("Arial", 16)
-            except IOError:
-                font = ImageFont.load_default()
-                
-            # Draw medication name centered below QR code
-            text_width = draw.textlength(medication_name, font=font)
-            draw.text(((img_width - text_width) // 2, img_height + 10), medication_name, fill="black", font=font)
-            qr_img = new_img
-        
-        # Save QR code image
-        qr_filename = f"{instruction_id}.png"
-        qr_path = os.path.join(QR_DIR, qr_filename)
-        qr_img.save(qr_path)
-        
-        # Generate audio file if it doesn't exist
-        audio_filename = f"{instruction_id}.mp3"
-        audio_path = os.path.join(AUDIO_DIR, audio_filename)
+        # QR code that points to the instruction page, with the medication name below it
+        qr_url = qr_image_url(instruction_id, medication_name, requested_qr_format(data))
         
-        if not os.path.exists(audio_path):
-            # Create the audio file with gTTS
-            spoken_text = f"For {medication_name}: {instruction}" if medication_name else instruction
-            tts = gTTS(text=spoken_text, lang='en')
-            tts.save(audio_path)
+        # Queue the audio the instruction page will play, unless it is already cached
+        audio_status, audio_filename = queue_instruction_audio({'text': instruction, 'medication_name': medication_name})
+        audio_path = os.path.join(AUDIO_DIR, audio_filename)
         
         # Store the instruction text for this ID if it's not already stored
         instruction_data = {
             'medication_name': medication_name,
             'instruction': instruction,
-            'qr_path': qr_path,
+            'qr_path': qr_url,
             'audio_path': audio_path
         }
         
-        # Save instruction data to JSON file
-        instruction_data_file = os.path.join(app.static_folder, 'data', 'instructions.json')
-        
-        # Create the data directory if it doesn't exist
-        os.makedirs(os.path.dirname(instruction_data_file), exist_ok=True)
-        
-        # Load existing data if file exists
-        existing_data = {}
-        if os.path.exists(instruction_data_file):
-            try:
-                with open(instruction_data_file, 'r') as f:
-                    existing_data = json.loads(f.read())
-            except Exception as e:
-                print(f"Error loading instruction data: {e}")
-        
-        # Update with new data
-        existing_data[instruction_id] = instruction_data
-        
-        # Save updated data
-        with open(instruction_data_file, 'w') as f:
-            f.write(json.dumps(existing_data, indent=2))
+        # Save instruction data to the instruction store
+        save_instruction(instruction_id, instruction_data)
         
         # Return the QR code URL and instruction ID
         return jsonify({
             'status': 'success',
-            'qr_url': url_for('static', filename=f'qrcodes/{qr_filename}'),
-            'instruction_id': instruction_id
+            'qr_url': qr_url,
+            'instruction_id': instruction_id,
+            'audio_status': audio_status
         })
         
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)})
 
+# QR code image for an instruction, rendered on demand and cached by browsers and proxies
+@app.route('/qr/<instruction_id>.<any(png, svg, pdf):image_format>')
+def qr_image(instruction_id, image_format):
+    instruction_info = lookup_instruction(instruction_id)
+    if not instruction_info:
+        return instruction_not_found_response()
+    
+    # The label defaults to the stored medication name
+    stored_label = instruction_info.get('medication_name', '')
+    label = request.args.get('label', stored_label)
+    if label != stored_label and len(label) > QR_LABEL_MAX_LENGTH:
+        return jsonify({'status': 'error',
+                        'message': f'label must be at most {QR_LABEL_MAX_LENGTH} characters'}), 400
+    url = url_for('instruction_page', instruction_id=instruction_id, _external=True)
+    
+    # Answer revalidations from the render key alone, without rendering
+    render_key = qr_renderer.render_key(url, label, image_format)
+    if request.if_none_match.contains(render_key):
+        response = Response(status=304)
+    else:
+        render_key, image = get_qr_image(url, label, image_format, cache=label == stored_label)
+        response = Response(image, mimetype=QR_IMAGE_MIMETYPES[image_format])
+    response.set_etag(render_key)
+    response.cache_control.public = True
+    response.cache_control.max_age = QR_IMAGE_MAX_AGE
+    return response
+
+# gTTS language codes for the languages instructions can be written in
+TTS_LANGUAGES = {
+    'en': 'en-gb',  # English -> British English
+    'fr': 'fr',     # French
+    'es': 'es',     # Spanish
+    'de': 'de',     # German
+    'it': 'it',     # Italian
+    'pt': 'pt',     # Portuguese
+    'ru': 'ru',     # Russian
+    'zh-cn': 'zh-CN', # Chinese (Simplified)
+    'ja': 'ja',     # Japanese
+    'ko': 'ko',     # Korean
+    'ar': 'ar',     # Arabic
+    'hi': 'hi',     # Hindi
+    'pl': 'pl',     # Polish
+    'nl': 'nl',     # Dutch
+    'tr': 'tr',     # Turkish
+    # Add more language mappings as needed
+}
+
+def get_spoken_instruction(instruction_info):
+    """
+    Return (spoken_text, clean_text) for an instruction: the instruction text with its
+    HTML tags turned into pauses, read after the medication name
+    """
+    instruction_text = (instruction_info.get('text') or instruction_info.get('instruction')
+                        or instruction_info.get('instructions', ''))
+    clean_text = html_to_speech_text(instruction_text)
+    
+    if instruction_info.get('medication_name'):
+        return f"For {instruction_info.get('medication_name')}, {clean_text}", clean_text
+    return clean_text, clean_text
+
+def get_tts_language(instruction_info, clean_text):
+    """gTTS language for an instruction: its specified language, else a guess from the text"""
+    # Instead of auto-detecting the language, check if a language is specified in the instruction data
+    if instruction_info.get('language'):
+        # Use the specified language if it's in our map
+        return TTS_LANGUAGES.get(instruction_info.get('language'), 'en-gb')
+    
+    # If no language is specified, we can use some simple heuristics to guess
+    # This is a fallback only
+    lower_text = clean_text.lower()
+    if 'comprimé' in lower_text:
+        return 'fr'  # French
+    if 'tableta' in lower_text:
+        return 'es'  # Spanish
+    if 'tablette' in lower_text and 'mal' in lower_text:
+        return 'de'  # German
+    if 'таблетка' in lower_text:
+        return 'ru'  # Russian
+    return 'en-gb'  # Default to British English
+
+def get_instruction_speech(instruction_info):
+    """Return (spoken_text, tts_lang): what the instruction's audio says, and in which language"""
+    spoken_text, clean_text = get_spoken_instruction(instruction_info)
+    return spoken_text, get_tts_language(instruction_info, clean_text)
+
+def queue_instruction_audio(instruction_info):
+    """
+    Return (status, filename) for the spoken instruction, with filename inside AUDIO_DIR.
+    status is 'ready' if the audio is cached; otherwise it is queued for synthesis in the
+    background and status is 'pending', or 'failed' if synthesising it recently failed.
+    """
+    spoken_text, tts_lang = get_instruction_speech(instruction_info)
+    audio_filename = get_audio_filename(spoken_text, tts_lang)
+    
+    if is_audio_cached(audio_filename):
+        return 'ready', audio_filename
+    return audio_jobs.submit(audio_filename, get_or_create_audio, spoken_text, tts_lang), audio_filename
+
+def get_missing_audio():
+    """
+    Map the cache filename of each stored instruction's audio that isn't cached yet to its
+    (spoken_text, tts_lang). Instructions that are spoken the same appear once.
+    """
+    missing = {}
+    for instruction_info in instruction_store.load_all().values():
+        spoken_text, tts_lang = get_instruction_speech(instruction_info)
+        if not spoken_text:
+            continue
+        audio_filename = get_audio_filename(spoken_text, tts_lang)
+        if audio_filename not in missing and not os.path.exists(os.path.join(AUDIO_DIR, audio_filename)):
+            missing[audio_filename] = (spoken_text, tts_lang)
+    return missing
+
+def queue_missing_audio():
+    """Queue background synthesis of every stored instruction's missing audio. Returns the number queued."""
+    missing = get_missing_audio()
+    for audio_filename, (spoken_text, tts_lang) in missing.items():
+        audio_jobs.submit(audio_filename, get_or_create_audio, spoken_text, tts_lang)
+    return len(missing)
+
+# Status of an instruction's spoken audio, polled by the instruction page while it is synthesised
+@app.route('/instruction/<instruction_id>/audio')
+def instruction_audio(instruction_id):
+    instruction_info = lookup_instruction(instruction_id)
+    if not instruction_info:
+        return instruction_not_found_response()
+    
+    # Queues the audio again if the job was lost, e.g. it was queued by another worker that has restarted
+    audio_status, audio_filename = queue_instruction_audio(instruction_info)
+    return jsonify({
+        'status': audio_status,
+        'audio_url': f"/static/audio/{audio_filename}" if audio_status == 'ready' else None
+    })
+
+def get_instruction_page_key(page):
+    """Hash of the instruction page's template and everything it is rendered from"""
+    inputs = [get_template_version('instruction.html'), request.script_root, page]
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+def get_instruction_page(page_key, page):
+    """Get a rendered instruction page from the LRU cache, rendering it on a miss"""
+    with instruction_page_cache_lock:
+        html = instruction_page_cache.get(page_key)
+        if html is not None:
+            instruction_page_cache.move_to_end(page_key)
+            return html
+    
+    logger.debug("Rendering instruction page %s", page['instruction_id'])
+    html = render_template('instruction.html', **page).encode('utf-8')
+    with instruction_page_cache_lock:
+        instruction_page_cache[page_key] = html
+        while len(instruction_page_cache) > INSTRUCTION_PAGE_CACHE_SIZE:
+            instruction_page_cache.popitem(last=False)
+    return html
+
 # Page that displays the instruction and plays the audio
 @app.route('/instruction/<instruction_id>')
 def instruction_page(instruction_id):
+    # Every patient scan lands here, so this path logs only at debug level and does
+    # no work that grows with the number of instructions
     try:
-        print(f"\n\n==== PROCESSING INSTRUCTION PAGE REQUEST FOR ID: {instruction_id} ====\n")
-        print(f"Current instruction_texts keys: {list(instruction_texts.keys())}")
-        
-        # Check if we have the instruction text in memory
-        instruction_info = instruction_texts.get(instruction_id)
-        
-        # If we don't have the instruction in memory, try to load from file
-        if not instruction_info:
-            print(f"Instruction not found in memory: {instruction_id}, trying to load from file")
-            
-            # Try to load from the instructions.json file
-            instruction_data_file = os.path.join(app.static_folder, 'data', 'instructions.json')
-            
-            if os.path.exists(instruction_data_file):
-                try:
-                    with open(instruction_data_file, 'r') as f:
-                        all_instructions = json.load(f)
-                    
-                    print(f"Loaded instructions from file. Available IDs: {list(all_instructions.keys())}")
-                    
-                    # Check if the instruction ID exists in the file
-                    if instruction_id in all_instructions:
-                        instruction_info = all_instructions[instruction_id]
-                        # Store in memory for future use
-                        instruction_texts[instruction_id] = instruction_info
-                        print(f"Found instruction {instruction_id} in file and stored in memory")
-                except Exception as e:
-                    print(f"Error loading instruction data from file: {e}")
-                    
-        # Debug what we found
-        if instruction_info:
-            print(f"Instruction info found: {instruction_info}")
+        # Answered from memory, for unknown ids as well as known ones
+        instruction_info = lookup_instruction(instruction_id)
         
         # If we don't have the instruction info, return an error
         if not instruction_info:
-            print(f"Instruction not found: {instruction_id}")
-            print(f"Available instructions: {list(instruction_texts.keys())}")
+            logger.debug("Instruction not found: %s", instruction_id)
+            if not instruction_miss_allowed():
+                return render_template('error.html', message="Too many requests. Please try again later."), 429
             return render_template('error.html', message="Instruction not found. This QR code may be invalid or not yet generated."), 404
             
         # If we have instruction info but it's in the wrong format, fix it
@@ -1173,110 +1993,11 @@ def instruction_page(instruction_id):
         if instruction_info and 'medication_name' not in instruction_info:
             instruction_info['medication_name'] = ''
         
-        # Generate audio file if it doesn't exist or is older than 1 hour
-        audio_filename = f"{instruction_id}.mp3"
-        audio_path = os.path.join(AUDIO_DIR, audio_filename)
-        audio_url = f"/static/audio/{audio_filename}"
-        
-        # Check if file exists and when it was created
-        should_generate_audio = True
-        if os.path.exists(audio_path):
-            file_mod_time = datetime.fromtimestamp(os.path.getmtime(audio_path))
-            if datetime.now() - file_mod_time < timedelta(hours=1):
-                # File is fresh (less than 1 hour old), use it
-                should_generate_audio = False
-                print(f"Using existing audio file: {audio_path}")
-        
-        # Generate audio file if needed
-        if should_generate_audio:
-            try:
-                # Generate spoken text - replace HTML tags with periods
-                instruction_text = instruction_info.get('text', '')
-                # Replace <br> tags with periods
-                clean_text = re.sub(r'<br\s*/?>', '. ', instruction_text, flags=re.IGNORECASE)
-                # Replace <strong> and </strong> tags with periods
-                clean_text = re.sub(r'</?strong>', '. ', clean_text, flags=re.IGNORECASE)
-                # Replace any other HTML tags with periods
-                clean_text = re.sub(r'<[^>]*>', '. ', clean_text)
-                # Clean up multiple periods and spaces
-                clean_text = re.sub(r'\.\s*\.', '.', clean_text)
-                clean_text = re.sub(r'\s+', ' ', clean_text).strip()
-                
-                if instruction_info.get('medication_name'):
-                    spoken_text = f"For {instruction_info.get('medication_name')}, {clean_text}"
-                else:
-                    spoken_text = clean_text
-                
-                print(f"Generating audio for text: '{spoken_text}'")
-                
-                # Instead of auto-detecting the language, check if a language is specified in the instruction data
-                tts_lang = 'en-gb'  # Default to British English
-                
-                # Try to get the language from the instruction_info
-                if instruction_info.get('language'):
-                    specified_lang = instruction_info.get('language')
-                    print(f"Language specified in instruction data: {specified_lang}")
-                    
-                    # Map the specified language code to gTTS language code
-                    lang_map = {
-                        'en': 'en-gb',  # English -> British English
-                        'fr': 'fr',     # French
-                        'es': 'es',     # Spanish
-                        'de': 'de',     # German
-                        'it': 'it',     # Italian
-                        'pt': 'pt',     # Portuguese
-                        'ru': 'ru',     # Russian
-                        'zh-cn': 'zh-CN', # Chinese (Simplified)
-                        'ja': 'ja',     # Japanese
-                        'ko': 'ko',     # Korean
-                        'ar': 'ar',     # Arabic
-                        'hi': 'hi',     # Hindi
-                        'pl': 'pl',     # Polish
-                        'nl': 'nl',     # Dutch
-                        'tr': 'tr',     # Turkish
-                        # Add more language mappings as needed
-                    }
-                    
-                    # Use the specified language if it's in our map
-                    tts_lang = lang_map.get(specified_lang, 'en-gb')
-                else:
-                    # If no language is specified, we can use some simple heuristics to guess
-                    # This is a fallback only
-                    if 'comprimé' in clean_text.lower():
-                        tts_lang = 'fr'  # French
-                    elif 'tableta' in clean_text.lower():
-                        tts_lang = 'es'  # Spanish
-                    elif 'tablette' in clean_text.lower() and 'mal' in clean_text.lower():
-                        tts_lang = 'de'  # German
-                    elif 'таблетка' in clean_text.lower():
-                        tts_lang = 'ru'  # Russian
-                    
-                    print(f"No language specified, using heuristic detection: {tts_lang}")
-                
-                print(f"Using TTS language: {tts_lang}")
-                    
-                # Create audio with specified/detected language
-                tts = gTTS(text=spoken_text, lang=tts_lang, slow=False)
-                print(f"Saving audio to: {audio_path}")
-                tts.save(audio_path)
-                
-                print(f"Generated new audio file: {audio_path}")
-                # Verify file was created
-                if os.path.exists(audio_path):
-                    file_size = os.path.getsize(audio_path)
-                    print(f"Audio file created successfully. Size: {file_size} bytes")
-                else:
-                    print(f"WARNING: Audio file was not created at {audio_path}")
-                    audio_url = None
-            except Exception as e:
-                print(f"Error generating audio file: {e}")
-                # If there's an error generating the audio, we'll fall back to Web Speech API
-                audio_url = None
-        
-        # Verify the audio file exists
-        if not os.path.exists(audio_path):
-            print(f"Audio file does not exist: {audio_path}")
-            audio_url = None
+        # Spoken instruction, synthesised in the background if it isn't cached yet. Until it is
+        # ready the page polls audio_status_url and falls back to the Web Speech API.
+        audio_status, audio_filename = queue_instruction_audio(instruction_info)
+        audio_url = f"/static/audio/{audio_filename}" if audio_status == 'ready' else None
+        audio_status_url = url_for('instruction_audio', instruction_id=instruction_id) if audio_status == 'pending' else None
         
         # Get instruction text for display
         instruction_text = ""
@@ -1292,26 +2013,29 @@ def instruction_page(instruction_id):
             timing = instruction_info.get('timing', '')
             route = instruction_info.get('route', '')
         
-        # Debug the values we're passing to the template
-        print(f"Rendering template with:")
-        print(f"  - instruction_text: {instruction_text}")
-        print(f"  - medication_name: {medication_name}")
-        print(f"  - dosage: {dosage}")
-        print(f"  - timing: {timing}")
-        print(f"  - route: {route}")
-        print(f"  - audio_url: {audio_url}")
-        
-        return render_template('instruction.html', 
-                               instruction_id=instruction_id,
-                               instruction_text=instruction_text,
-                               medication_name=medication_name,
-                               dosage=dosage,
-                               timing=timing,
-                               route=route,
-                               audio_url=audio_url)
+        page = {
+            'instruction_id': instruction_id,
+            'instruction_text': instruction_text,
+            'medication_name': medication_name,
+            'dosage': dosage,
+            'timing': timing,
+            'route': route,
+            'audio_url': audio_url,
+            'audio_status_url': audio_status_url,
+        }
+        
+        # Answer revalidations from the page key alone, without rendering
+        page_key = get_instruction_page_key(page)
+        if request.if_none_match.contains(page_key):
+            response = Response(status=304)
+        else:
+            response = Response(get_instruction_page(page_key, page), mimetype='text/html')
+        response.set_etag(page_key)
+        response.cache_control.no_cache = True
+        return response
     
     except Exception as e:
-        print(f"Error in instruction_page: {e}")
+        logger.exception("Error in instruction_page for %s", instruction_id)
         return render_template('error.html', message=str(e)), 500
 
 
@@ -1336,15 +2060,7 @@ def create_instruction_page():
         route = data.get('route', '')
         
         # Replace HTML tags with periods
-        # Replace <br> tags with periods
-        clean_instructions = re.sub(r'<br\s*/?>', '. ', instructions, flags=re.IGNORECASE)
-        # Replace <strong> and </strong> tags with periods
-        clean_instructions = re.sub(r'</?strong>', '. ', clean_instructions, flags=re.IGNORECASE)
-        # Replace any other HTML tags with periods
-        clean_instructions = re.sub(r'<[^>]*>', '. ', clean_instructions)
-        # Clean up multiple periods and spaces
-        clean_instructions = re.sub(r'\.\s*\.', '.', clean_instructions)
-        clean_instructions = re.sub(r'\s+', ' ', clean_instructions).strip()
+        clean_instructions = html_to_speech_text(instructions)
         
         # Create the instruction data
         instruction_data = {
@@ -1356,13 +2072,11 @@ def create_instruction_page():
             'route': route
         }
         
-        # Store the instruction data in memory
-        instruction_texts[instruction_id] = instruction_data
+        # Store the instruction data in memory and in the instruction store
+        save_instruction(instruction_id, instruction_data)
         
-        # Save to file
-        save_instruction_data()
-        
-        # No need to create audio files anymore as we're using Web Speech API
+        # The spoken instruction is synthesised in the background when the page is first
+        # scanned (see queue_instruction_audio())
         
         return jsonify({
             'status': 'success', 
@@ -1372,37 +2086,22 @@ def create_instruction_page():
         })
     
     except Exception as e:
-        print(f"Error creating instruction page: {e}")
+        logger.exception("Error creating instruction page")
         return jsonify({'status': 'error', 'message': str(e)}), 500
         
 # Get instruction text for a specific instruction ID
 @app.route('/get_instruction_text/<instruction_id>', methods=['GET'])
 def get_instruction_text(instruction_id):
     try:
-        # For now, we'll store instruction data in a simple JSON file
-        # In a real application, this would be stored in a database
-        instruction_data_file = os.path.join(app.static_folder, 'data', 'instructions.json')
-        
-        # Create the data directory if it doesn't exist
-        os.makedirs(os.path.dirname(instruction_data_file), exist_ok=True)
-        
-        # Initialize with empty data
-        instruction_data = {}
-        
-        # Load existing data if file exists
-        if os.path.exists(instruction_data_file):
-            try:
-                with open(instruction_data_file, 'r') as f:
-                    instruction_data = json.load(f)
-            except Exception as e:
-                print(f"Error loading instruction data: {e}")
+        # Look up just this instruction
+        instruction_data = lookup_instruction(instruction_id)
         
         # Check if we have data for this instruction ID
-        if instruction_id in instruction_data:
+        if instruction_data:
             return jsonify({
                 'status': 'success',
-                'instruction': instruction_data[instruction_id]['instruction'],
-                'medication_name': instruction_data[instruction_id].get('medication_name', '')
+                'instruction': instruction_data['instruction'],
+                'medication_name': instruction_data.get('medication_name', '')
             })
         else:
             # If we don't have the data, try to infer it from the audio filename
@@ -1426,14 +2125,16 @@ def generate_qr_codes_for_medications():
         data = request.json
         medications = data.get('medications', [])
         
-        # Debug logging
-        print(f"Received request to generate QR codes for {len(medications)} medications")
-        print(f"Medications data: {medications}")
+        logger.info("Generating QR codes for %d medications", len(medications))
+        logger.debug("Medications data: %r", medications)
         
         if not medications:
             return jsonify({'status': 'error', 'message': 'No medications provided'})
         
+        image_format = requested_qr_format(data)
         results = []
+        new_instructions = {}
+        qr_pages = []
         for med in medications:
             medication_name = med.get('name', '')
             instruction = med.get('instructions', '')
@@ -1441,113 +2142,44 @@ def generate_qr_codes_for_medications():
             if instruction:
                 # Generate QR code for this instruction
                 instruction_id = generate_instruction_id(instruction)
-                qr_filename = f"{instruction_id}.png"
                 
-                # Check if QR code already exists
-                qr_path = os.path.join(QR_DIR, qr_filename)
-                if not os.path.exists(qr_path):
-                    # Create the QR code
-                    qr_url = url_for('instruction_page', instruction_id=instruction_id, _external=True)
-                    qr = qrcode.QRCode(
-                        version=1,
-                        error_correction=qrcode.constants.ERROR_CORRECT_L,
-                        box_size=10,
-                        border=4,
-                    )
-                    qr.add_data(qr_url)
-                    qr.make(fit=True)
-                    
-                    # Create QR code image with medication name
-                    qr_img = qr.make_image(fill_color="black", back_color="white")
-                    
-                    # Add medication name as text below QR code
-                    if medication_name:
-                        # Create a new image with space for text
-                        img_width, img_height = qr_img.size
-                        new_img = Image.new('RGB', (img_width, img_height + 40), 'white')
-                        new_img.paste(qr_img, (0, 0))
-                        
-                        # Add text
-                        draw = ImageDraw.Draw(new_img)
-                        try:
-                            font = ImageFont.truetype("Arial", 16)
-                        except IOError:
-                            font = ImageFont.load_default()
-                            
-                        # Draw medication name centered below QR code
-                        text_width = draw.textlength(medication_name, font=font)
-                        draw.text(((img_width - text_width) // 2, img_height + 10), medication_name, fill="black", font=font)
-                        qr_img = new_img
-                    
-                    # Save QR code image
-                    qr_img.save(qr_path)
+                # Queue the QR code, with the medication name below it
+                qr_url = qr_image_url(instruction_id, medication_name, image_format)
+                qr_pages.append((instruction_id, medication_name))
                 
-                # Generate audio file if it doesn't exist
-                audio_filename = f"{instruction_id}.mp3"
+                # Queue the audio the instruction page will play, unless it is already cached
+                audio_status, audio_filename = queue_instruction_audio({'text': instruction,
+                                                                        'medication_name': medication_name})
                 audio_path = os.path.join(AUDIO_DIR, audio_filename)
                 
-                if not os.path.exists(audio_path):
-                    # Create the audio file with gTTS
-                    spoken_text = f"For {medication_name}: {instruction}" if medication_name else instruction
-                    tts = gTTS(text=spoken_text, lang='en')
-                    tts.save(audio_path)
-                
                 # Store instruction data
                 instruction_data = {
                     'medication_name': medication_name,
                     'text': instruction,  # Use 'text' key to match what instruction_page expects
-                    'qr_path': qr_path,
+                    'qr_path': qr_url,
                     'audio_path': audio_path
                 }
                 
-                # Save instruction data to JSON file
-                instruction_data_file = os.path.join(app.static_folder, 'data', 'instructions.json')
-                
-                # Create the data directory if it doesn't exist
-                data_dir = os.path.dirname(instruction_data_file)
-                os.makedirs(data_dir, exist_ok=True)
-                print(f"Ensuring data directory exists: {data_dir}")
-                
-                # Make sure we're using the global instruction_texts variable
-                global instruction_texts
-                
-                # Store instruction text in memory with consistent key names
-                instruction_texts[instruction_id] = {
-                    'text': instruction,
-                    'medication_name': medication_name
-                }
-                print(f"Stored instruction in memory with ID: {instruction_id}")
-                
-                # Load existing data if file exists
-                existing_data = {}
-                if os.path.exists(instruction_data_file):
-                    try:
-                        with open(instruction_data_file, 'r') as f:
-                            existing_data = json.loads(f.read())
-                        print(f"Loaded existing instruction data with {len(existing_data)} entries")
-                    except Exception as e:
-                        print(f"Error loading instruction data: {e}")
-                
-                # Update with new data
-                existing_data[instruction_id] = instruction_data
-                
-                # Save updated data
-                try:
-                    with open(instruction_data_file, 'w') as f:
-                        f.write(json.dumps(existing_data, indent=2))
-                    print(f"Successfully saved instruction data to {instruction_data_file}")
-                    print(f"Total instructions saved: {len(existing_data)}")
-                except Exception as e:
-                    print(f"Error saving instruction data: {e}")
+                # Collect instruction data so the whole batch is saved in one write
+                new_instructions[instruction_id] = instruction_data
                 
                 # Add result
                 results.append({
                     'medication_name': medication_name,
                     'instruction': instruction,
-                    'qr_url': url_for('static', filename=f'qrcodes/{qr_filename}'),
-                    'instruction_id': instruction_id
+                    'qr_url': qr_url,
+                    'instruction_id': instruction_id,
+                    'audio_status': audio_status
                 })
         
+        # Render the QR codes the page is about to show in one batch
+        prerender_qr_images(qr_pages, image_format)
+        
+        # Save instruction data to the instruction store
+        if new_instructions:
+            save_instructions(new_instructions)
+            logger.info("Saved %d instructions to the %s store", len(new_instructions), instruction_store.name)
+        
         return jsonify({
             'status': 'success',
             'results': results
@@ -1585,23 +2217,55 @@ def ensure_instruction_pages():
 # Generate a PDF with QR code stickers for printing
 @app.route('/generate_qr_stickers', methods=['POST'])
 def generate_qr_stickers():
+    """
+    Lay out QR code stickers for a list of instruction ids on A4 label sheets.
+    An id may be repeated for several stickers. Optional settings: "layout" (a named
+    sheet, default a4-24 as printed by the chart generator), "layout_overrides" (e.g.
+    {"rows": 7, "top_margin": 15}, in mm) and "skip" (blank labels at the start of a
+    part-used sheet).
+    """
+    data = request.json or {}
+    instruction_ids = data.get('instruction_ids', [])
+    
+    if not instruction_ids:
+        return jsonify({'status': 'error', 'message': 'No instructions provided'})
+    if (not isinstance(instruction_ids, list) or len(instruction_ids) > STICKER_MAX_LABELS
+            or not all(isinstance(instruction_id, str) for instruction_id in instruction_ids)):
+        return jsonify({'status': 'error',
+                        'message': f'instruction_ids must be a list of at most {STICKER_MAX_LABELS} id strings'}), 400
+    
     try:
-        data = request.json
-        instruction_ids = data.get('instruction_ids', [])
-        
-        if not instruction_ids:
-            return jsonify({'status': 'error', 'message': 'No instructions provided'})
-        
-        # TODO: Implement PDF generation for QR code stickers
-        # This would create a PDF with multiple QR codes arranged for printing on sticker sheets
-        
-        return jsonify({
-            'status': 'success',
-            'message': 'QR stickers generated successfully'
-        })
-        
-    except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        layout = get_sticker_layout(data.get('layout'), data.get('layout_overrides'))
+        skip = int(data.get('skip', 0))
+        if not 0 <= skip < layout['columns'] * layout['rows']:
+            raise ValueError('skip must be less than the number of labels on a sheet')
+    except (TypeError, ValueError) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    stickers = []
+    missing_ids = []
+    for instruction_id in instruction_ids:
+        instruction_info = lookup_instruction(instruction_id)
+        if not instruction_info:
+            missing_ids.append(instruction_id)
+            continue
+        url = url_for('instruction_page', instruction_id=instruction_id, _external=True)
+        stickers.append((url, instruction_info.get('medication_name', '')))
+    
+    if not stickers:
+        return jsonify({'status': 'error', 'message': 'None of the instructions were found',
+                        'missing_ids': missing_ids}), 404
+    
+    # Spool the PDF to disk past a small size, so a large batch doesn't sit in memory
+    output = tempfile.SpooledTemporaryFile(max_size=STICKER_SPOOL_BYTES)
+    pages = write_sticker_sheet(output, stickers, qr_renderer, layout, skip)
+    output.seek(0)
+    
+    response = send_file(output, mimetype='application/pdf', download_name='qr_stickers.pdf')
+    response.headers['X-Sticker-Pages'] = str(pages)
+    if missing_ids:
+        response.headers['X-Missing-Instruction-Ids'] = ','.join(missing_ids)
+    return response
 
 # Export all medication data as a downloadable JSON file
 @app.route('/export_medication_data')
@@ -1614,15 +2278,14 @@ def export_medication_data():
         # Create a backup file in the backups directory
         backup_path = os.path.join(BACKUP_DIR, filename)
         
-        # Save the current data to the backup file
-        with open(backup_path, 'w') as f:
-            json.dump(instruction_texts, f, indent=2)
+        # Export the instruction store to the backup file in instructions.json format
+        instruction_store.export_json(backup_path)
         
         # Send the file as a download
         return send_file(backup_path, as_attachment=True, download_name=filename)
     
     except Exception as e:
-        print(f"Error exporting medication data: {e}")
+        logger.exception("Error exporting medication data")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 # Import medication data from a JSON file
@@ -1655,14 +2318,10 @@ def import_medication_data():
         backup_filename = f"pre_import_backup_{timestamp}.json"
         backup_path = os.path.join(BACKUP_DIR, backup_filename)
         
-        with open(backup_path, 'w') as f:
-            json.dump(instruction_texts, f, indent=2)
-        
-        # Update the instruction_texts dictionary with the imported data
-        instruction_texts.update(data)
+        instruction_store.export_json(backup_path)
         
-        # Save the updated data
-        save_instruction_data()
+        # Save the imported data to memory and to the instruction store
+        save_instructions(data)
         
         return jsonify({
             'status': 'success', 
@@ -1671,7 +2330,7 @@ def import_medication_data():
         })
     
     except Exception as e:
-        print(f"Error importing medication data: {e}")
+        logger.exception("Error importing medication data")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 # Get a list of all available medication data
@@ -1679,8 +2338,9 @@ def import_medication_data():
 def list_medication_data():
     try:
         # Create a list of medication data with basic info
+        sync_instruction_texts()
         medications = []
-        for instruction_id, data in instruction_texts.items():
+        for instruction_id, data in list(instruction_texts.items()):
             medications.append({
                 'id': instruction_id,
                 'medication_name': data.get('medication_name', ''),
@@ -1695,13 +2355,56 @@ def list_medication_data():
         })
     
     except Exception as e:
-        print(f"Error listing medication data: {e}")
+        logger.exception("Error listing medication data")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 # NOTE: Thermal printer support has been removed as we now use standard A4 label sheets
 # The thermal printing functionality has been replaced with a grid-based A4 label printing solution
 # implemented directly in chartgenerator.html
 
+@app.cli.command('export-instructions')
+@click.argument('path', required=False)
+def export_instructions_command(path):
+    """Export the instruction store in instructions.json format (default: static/data/instructions.json)"""
+    path = path or INSTRUCTION_DATA_FILE
+    instruction_store.export_json(path)
+    click.echo(f"Exported {instruction_store.count()} instructions to {path}")
+
+@app.cli.command('prewarm-audio')
+@click.option('--workers', type=int, default=4, show_default=True, help='number of syntheses to run at once')
+def prewarm_audio_command(workers):
+    """Synthesise the audio for every stored instruction that isn't cached yet"""
+    missing = get_missing_audio()
+    click.echo(f"Synthesising {len(missing)} audio files with {tts_backend.name}, {workers} at a time")
+    
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(get_or_create_audio, spoken_text, tts_lang): spoken_text
+                   for spoken_text, tts_lang in missing.values()}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                future.result()
+                outcome = 'done'
+            except Exception as e:
+                failed += 1
+                outcome = f"failed ({e})"
+            click.echo(f"[{done}/{len(futures)}] {outcome}: {futures[future][:60]}")
+    
+    click.echo(f"Synthesised {len(missing) - failed} audio files, {failed} failed")
+    if failed:
+        raise SystemExit(1)
+
+# Load and precompress the static assets now, so the first page load doesn't wait on it
+for asset in static_assets.values():
+    try:
+        asset.current()
+    except FileNotFoundError:
+        logger.warning("Static asset not found: %s", asset.path)
+
+# Queue audio for the stored instructions in the background, so first scans don't wait on synthesis
+if AUDIO_PREWARM:
+    logger.info("Queued audio for %d instructions", queue_missing_audio())
+
 if __name__ == '__main__':
     import os
     port = int(os.environ.get('PORT', 5001))
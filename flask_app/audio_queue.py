@@ -0,0 +1,61 @@
+"""
+Audio Queue
+
+Runs text-to-speech synthesis on a small pool of background threads, so requests
+that need a spoken instruction return straight away instead of waiting on the TTS
+service. Jobs are keyed by their audio cache key: submitting a job that is already
+queued or running joins it rather than synthesising the same audio twice. Failures
+are remembered for retry_after seconds, so pages polling for the audio see the
+failure instead of retrying the synthesis on every poll.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Most failures remembered at once; the oldest are forgotten (and so retried) first
+MAX_REMEMBERED_FAILURES = 1024
+
+
+class AudioJobQueue:
+    """Background synthesis jobs, at most one queued or running per key"""
+
+    def __init__(self, workers=2, retry_after=60):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tts')
+        self.retry_after = retry_after
+        self.jobs = {}
+        self.failures = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, key, function, *args):
+        """
+        Run function(*args) in the background under key, unless a job for key is already
+        queued or running or failed within the last retry_after seconds.
+        Returns the job's status, 'pending' or 'failed'.
+        """
+        with self.lock:
+            if key in self.jobs:
+                return 'pending'
+            failure = self.failures.get(key)
+            if failure and time.time() - failure[0] < self.retry_after:
+                return 'failed'
+            self.failures.pop(key, None)
+            future = self.executor.submit(function, *args)
+            self.jobs[key] = future
+        # Outside the lock: the callback runs straight away if the job has already finished
+        future.add_done_callback(lambda done: self.finished(key, done))
+        return 'pending'
+
+    def finished(self, key, future):
+        error = future.exception()
+        with self.lock:
+            self.jobs.pop(key, None)
+            if error is not None:
+                self.failures[key] = (time.time(), str(error))
+                while len(self.failures) > MAX_REMEMBERED_FAILURES:
+                    self.failures.popitem(last=False)
+        if error is not None:
+            logger.error("Error generating audio %s: %s", key, error)
@@ -0,0 +1,370 @@
+"""
+Benchmarks for the Medication Chart Generator Flask application.
+
+Run from the flask_app directory, for example:
+    python benchmarks.py extract --letters 2000
+    python benchmarks.py pdf-match --rounds 3
+    python benchmarks.py instruction-store --backend journal --processes 8 --writes 500
+    python benchmarks.py qr --images 200 --pool process
+    python benchmarks.py qr-formats --images 200
+    python benchmarks.py tts --backend espeak --backend stub --phrases 20 --threads 4
+    python benchmarks.py speech-text --rounds 200
+    python benchmarks.py static-assets --requests 500
+"""
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app as chart_app
+import matching_reference
+from instruction_store import create_instruction_store
+from qr_renderer import IMAGE_FORMATS, QRRenderer, create_render_executor
+from speech_text import html_to_speech_text
+from tts_backends import TTS_BACKENDS, create_tts_backend
+
+
+def benchmark_extract(args):
+    """Measure discharge letter extraction throughput (letters per second) on one core"""
+    with open(os.path.join(chart_app.app.static_folder, 'test_discharge_letter.html'), 'r') as f:
+        letter = f.read()
+    
+    # Warm the enrichment caches the same way a long-running worker would be
+    medications = chart_app.extract_and_enrich_medications(letter)
+    
+    start = time.perf_counter()
+    for _ in range(args.letters):
+        chart_app.extract_and_enrich_medications(letter)
+    elapsed = time.perf_counter() - start
+    
+    print(f"Extracted {len(medications)} medications per letter from {args.letters} letters in {elapsed:.3f}s")
+    print(f"{args.letters / elapsed:.0f} letters/second")
+
+
+def benchmark_pdf_match(args):
+    """
+    Check that find_matching_pdf() and get_formatted_medication_name() give the same
+    results as the original functions (matching_reference.py) for every drug_aliases.json
+    name and alias, alone, with each form suffix and paired with a mapped medication,
+    then time both
+    """
+    catalogue = chart_app.get_pdf_catalogue()
+    with open(chart_app.DRUG_ALIASES_FILE, 'r') as f:
+        drugs = json.load(f)
+    
+    names = {term for drug in drugs for term in [drug['name']] + drug.get('aliases', [])}
+    suffixes = [''] + [f" {alias}" for aliases in chart_app.FORM_ALIASES.values() for alias in aliases]
+    queries = [f"{name}{suffix}" for name in sorted(names) for suffix in suffixes]
+    mapped = sorted({med_key for matcher in catalogue.pdf_matchers.values() for med_key in matcher.priority})
+    queries += [f"{name} {med_key} tablets" for name in sorted(names) for med_key in mapped]
+    queries += [f"{first} and {second}" for first in mapped for second in mapped]
+    
+    functions = {
+        'leaflet': (lambda query: chart_app.find_matching_pdf(query, 'leaflet'),
+                    lambda query: matching_reference.find_matching_pdf(query, 'leaflet')),
+        'pictorial': (lambda query: chart_app.find_matching_pdf(query, 'pictorial'),
+                      lambda query: matching_reference.find_matching_pdf(query, 'pictorial')),
+        'display name': (chart_app.get_formatted_medication_name,
+                         matching_reference.get_formatted_medication_name),
+    }
+    mismatches = []
+    for label, (match, reference) in functions.items():
+        for query in queries:
+            expected = reference(query)
+            if match(query) != expected:
+                mismatches.append((label, query, expected, match(query)))
+    print(f"Parity: {len(mismatches)} mismatches in {len(queries)} names for {', '.join(functions)}")
+    for mismatch in mismatches[:5]:
+        print(f"  {mismatch!r}")
+    
+    for label, (match, reference) in functions.items():
+        for name, function in (('original', reference), ('current', match)):
+            start = time.perf_counter()
+            for _ in range(args.rounds):
+                for query in queries:
+                    function(query)
+            elapsed = time.perf_counter() - start
+            print(f"{label} {name}: {elapsed / (args.rounds * len(queries)) * 1e6:.2f} us/name")
+    
+    if mismatches:
+        raise SystemExit(1)
+
+
+def open_stress_store(args, directory):
+    return create_instruction_store(args.backend, os.path.join(directory, 'instructions.json'),
+                                    os.path.join(directory, 'instructions.db'),
+                                    os.path.join(directory, 'instructions.journal'), args.compact_after)
+
+
+def instruction_store_writer(args, directory, worker, start_event):
+    """Save args.writes instructions one at a time, as separate requests would"""
+    store = open_stress_store(args, directory)
+    start_event.wait()
+    for i in range(args.writes):
+        store.put(f"worker{worker}-{i}", {'text': f"Instruction {i}", 'medication_name': f"Worker {worker}"})
+    
+    # Every worker must end up seeing every other worker's writes
+    if store.get(f"worker{worker}-{args.writes - 1}") is None:
+        raise SystemExit(1)
+
+
+def benchmark_instruction_store(args):
+    """
+    Stress test: several processes save to one instruction store at once, then check
+    that no update was lost and that a cached copy notices the other processes' writes
+    """
+    directory = tempfile.mkdtemp(prefix='instruction-store-')
+    try:
+        reader = open_stress_store(args, directory)
+        reader.put('seed', {'text': 'Seed instruction', 'medication_name': ''})
+        cached_version = reader.version()
+        
+        start_event = multiprocessing.Event()
+        workers = [multiprocessing.Process(target=instruction_store_writer, args=(args, directory, worker, start_event))
+                   for worker in range(args.processes)]
+        for worker in workers:
+            worker.start()
+        
+        start = time.perf_counter()
+        start_event.set()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        
+        expected = args.processes * args.writes + 1
+        stored = reader.load_all()
+        lost = expected - len(stored)
+        failed_workers = sum(1 for worker in workers if worker.exitcode != 0)
+        
+        print(f"{args.backend} store: {args.processes} processes x {args.writes} writes in {elapsed:.3f}s "
+              f"({args.processes * args.writes / elapsed:.0f} writes/second)")
+        print(f"Stored {len(stored)} of {expected} instructions, {lost} lost")
+        print(f"Cached copy invalidated: {reader.version() != cached_version}")
+        if lost or failed_workers or reader.version() == cached_version:
+            raise SystemExit("Instruction store stress test FAILED")
+        print("Instruction store stress test passed")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def benchmark_qr(args):
+    """Measure QR code rendering throughput (labelled PNG images per second)"""
+    medications = chart_app.get_all_medications()
+    jobs = [(f"http://localhost:5000/instruction/{chart_app.generate_instruction_id(f'Instruction {i}')}",
+             "{name} {formulation}".format(**medications[i % len(medications)]))
+            for i in range(args.images)]
+    
+    executor = create_render_executor(args.pool, args.workers)
+    try:
+        # Fresh renderer, so the first pass builds every QR matrix
+        renderer = QRRenderer()
+        if executor:
+            # Start the pool's workers before timing
+            renderer.render_batch(jobs[:2], executor)
+        for label in ('cold', 'warm'):
+            start = time.perf_counter()
+            images = renderer.render_batch(jobs, executor)
+            elapsed = time.perf_counter() - start
+            print(f"{label} ({args.pool or 'no pool'}): rendered {len(images)} images in {elapsed:.3f}s, "
+                  f"{len(images) / elapsed:.0f} images/second")
+    finally:
+        if executor:
+            executor.shutdown()
+
+
+def benchmark_qr_formats(args):
+    """Compare CPU time and payload size of the PNG, SVG and PDF QR code outputs"""
+    medications = chart_app.get_all_medications()
+    jobs = [(f"http://localhost:5000/instruction/{chart_app.generate_instruction_id(f'Instruction {i}')}",
+             "{name} {formulation}".format(**medications[i % len(medications)]))
+            for i in range(args.images)]
+    
+    # Build every QR matrix first, so only the output encoding is timed
+    renderer = QRRenderer()
+    for url, _ in jobs:
+        renderer.get_matrix(url)
+    
+    for image_format in IMAGE_FORMATS:
+        start = time.process_time()
+        images = renderer.render_batch(jobs, image_format=image_format)
+        elapsed = time.process_time() - start
+        size = sum(len(image) for image in images) / len(images)
+        gzipped_size = sum(len(gzip.compress(image)) for image in images) / len(images)
+        print(f"{image_format}: {elapsed / len(images) * 1000:.2f} ms CPU/image, {size:.0f} bytes/image "
+              f"({gzipped_size:.0f} gzipped)")
+
+
+def benchmark_tts(args):
+    """
+    Compare text-to-speech backends on real instructions: latency of one synthesis at a
+    time, then throughput with several syntheses running at once
+    """
+    phrases = []
+    for instruction_info in chart_app.instruction_store.load_all().values():
+        spoken_text, tts_lang = chart_app.get_instruction_speech(instruction_info)
+        if spoken_text:
+            phrases.append((spoken_text, tts_lang))
+        if len(phrases) == args.phrases:
+            break
+    
+    directory = tempfile.mkdtemp(prefix='tts-')
+    try:
+        for name in args.backend or TTS_BACKENDS:
+            try:
+                backend = create_tts_backend(name, args.piper_models)
+            except ValueError as e:
+                print(f"{name}: skipped ({e})")
+                continue
+            
+            def synthesise(job):
+                index, (text, lang) = job
+                path = os.path.join(directory, f"{name}-{index}.{backend.extension}")
+                start = time.perf_counter()
+                backend.synthesise(text, lang, path)
+                return time.perf_counter() - start, os.path.getsize(path)
+            
+            try:
+                results = [synthesise(job) for job in enumerate(phrases)]
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.threads) as executor:
+                    list(executor.map(synthesise, enumerate(phrases)))
+                elapsed = time.perf_counter() - start
+            except Exception as e:
+                print(f"{name}: failed ({e})")
+                continue
+            
+            latencies = sorted(latency for latency, _ in results)
+            mean_size = sum(size for _, size in results) / len(results)
+            print(f"{name}: {sum(latencies) / len(latencies) * 1000:.0f} ms mean, "
+                  f"{latencies[int(len(latencies) * 0.95)] * 1000:.0f} ms p95 latency, "
+                  f"{len(phrases) / elapsed:.1f} phrases/second with {args.threads} threads, "
+                  f"{mean_size / 1024:.0f} KB/phrase")
+    finally:
+        shutil.rmtree(directory)
+
+
+def regex_chain_speech_text(html):
+    """The original five-pass HTML to speech text cleaning, kept as the reference for parity checks"""
+    clean_text = re.sub(r'<br\s*/?>', '. ', html, flags=re.IGNORECASE)
+    clean_text = re.sub(r'</?strong>', '. ', clean_text, flags=re.IGNORECASE)
+    clean_text = re.sub(r'<[^>]*>', '. ', clean_text)
+    clean_text = re.sub(r'\.\s*\.', '.', clean_text)
+    return re.sub(r'\s+', ' ', clean_text).strip()
+
+
+def benchmark_speech_text(args):
+    """
+    Check that html_to_speech_text() matches the original regex chain on the stored
+    instructions and on random tag soup, then time both over the stored instructions
+    """
+    texts = [instruction_info.get('text') or instruction_info.get('instruction') or ''
+             for instruction_info in chart_app.instruction_store.load_all().values()]
+    
+    # Malformed HTML is where a single pass could drift from the chain
+    pieces = ['<br>', '<BR/>', '<br />', '<strong>', '</Strong>', '<b>', '</p>', '<', '>', '.', ' . ', '..',
+              '\n', ' ', 'ONE tablet', 'a', '/']
+    rng = random.Random(0)
+    fuzz = [''.join(rng.choice(pieces) for _ in range(rng.randint(0, 12))) for _ in range(args.fuzz)]
+    mismatches = [text for text in texts + fuzz
+                  if html_to_speech_text.__wrapped__(text) != regex_chain_speech_text(text)]
+    print(f"Parity: {len(mismatches)} mismatches in {len(texts)} instructions and {len(fuzz)} random inputs")
+    for text in mismatches[:5]:
+        print(f"  {text!r}")
+    
+    for label, clean in (('regex chain', regex_chain_speech_text),
+                         ('single pass', html_to_speech_text.__wrapped__),
+                         ('memoised', html_to_speech_text)):
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            for text in texts:
+                clean(text)
+        elapsed = time.perf_counter() - start
+        print(f"{label}: {elapsed / (args.rounds * len(texts)) * 1e6:.2f} us/instruction")
+    
+    if mismatches:
+        raise SystemExit(1)
+
+
+def benchmark_static_assets(args):
+    """Bytes sent and time per request for the pages and data files served from memory"""
+    client = chart_app.app.test_client()
+    with chart_app.app.test_request_context():
+        urls = chart_app.get_static_asset_urls()
+    
+    for url in ['/', '/original'] + sorted(urls.values()):
+        sizes = []
+        for accept_encoding in ('identity', 'gzip', 'br'):
+            response = client.get(url, headers={'Accept-Encoding': accept_encoding})
+            sizes.append(f"{response.headers.get('Content-Encoding', 'identity')} {len(response.data)}")
+        
+        etag = response.headers['ETag']
+        timings = []
+        for headers in ({'Accept-Encoding': 'gzip'}, {'Accept-Encoding': 'gzip', 'If-None-Match': etag}):
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                client.get(url, headers=headers)
+            timings.append((time.perf_counter() - start) / args.requests * 1000)
+        print(f"{url}: {', '.join(sizes)} bytes; {timings[0]:.2f} ms/request, {timings[1]:.2f} ms/revalidation")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    
+    extract_parser = subparsers.add_parser('extract', help='discharge letter extraction throughput')
+    extract_parser.add_argument('--letters', type=int, default=1000, help='number of letters to process')
+    extract_parser.set_defaults(func=benchmark_extract)
+    
+    store_parser = subparsers.add_parser('instruction-store', help='concurrent instruction store writes (stress test)')
+    store_parser.add_argument('--backend', choices=['sqlite', 'journal', 'json'], default='sqlite')
+    store_parser.add_argument('--processes', type=int, default=4, help='number of writer processes')
+    store_parser.add_argument('--writes', type=int, default=250, help='writes per process')
+    store_parser.add_argument('--compact-after', type=int, default=100,
+                              help='journal entries before the journal store compacts')
+    store_parser.set_defaults(func=benchmark_instruction_store)
+    
+    qr_parser = subparsers.add_parser('qr', help='QR code rendering throughput')
+    qr_parser.add_argument('--images', type=int, default=200, help='number of QR codes to render')
+    qr_parser.add_argument('--pool', choices=['thread', 'process'], help='render the batch on a worker pool')
+    qr_parser.add_argument('--workers', type=int, help='pool size (default: one per CPU)')
+    qr_parser.set_defaults(func=benchmark_qr)
+    
+    match_parser = subparsers.add_parser('pdf-match', help='medication to PDF matching: parity and speed')
+    match_parser.add_argument('--rounds', type=int, default=3, help='passes over the generated names')
+    match_parser.set_defaults(func=benchmark_pdf_match)
+    
+    formats_parser = subparsers.add_parser('qr-formats', help='QR code PNG vs SVG vs PDF CPU time and size')
+    formats_parser.add_argument('--images', type=int, default=200, help='number of QR codes per format')
+    formats_parser.set_defaults(func=benchmark_qr_formats)
+    
+    tts_parser = subparsers.add_parser('tts', help='text-to-speech backend latency and throughput')
+    tts_parser.add_argument('--backend', action='append', choices=TTS_BACKENDS,
+                            help='backend to measure, may be repeated (default: all that are installed)')
+    tts_parser.add_argument('--phrases', type=int, default=20, help='number of instructions to synthesise')
+    tts_parser.add_argument('--threads', type=int, default=4, help='concurrent syntheses for the throughput run')
+    tts_parser.add_argument('--piper-models', default=chart_app.TTS_PIPER_MODELS,
+                            help='piper voice models, as "lang=path,..." (default: TTS_PIPER_MODELS)')
+    tts_parser.set_defaults(func=benchmark_tts)
+    
+    speech_parser = subparsers.add_parser('speech-text', help='HTML to speech text cleaning: parity and speed')
+    speech_parser.add_argument('--rounds', type=int, default=200, help='passes over the stored instructions')
+    speech_parser.add_argument('--fuzz', type=int, default=20000, help='random inputs for the parity check')
+    speech_parser.set_defaults(func=benchmark_speech_text)
+    
+    assets_parser = subparsers.add_parser('static-assets', help='precompressed page and data file sizes and latency')
+    assets_parser.add_argument('--requests', type=int, default=500, help='requests per URL')
+    assets_parser.set_defaults(func=benchmark_static_assets)
+    
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+File Cache
+
+Helpers for the on-disk caches (merged PDF packs and instruction audio). Entries are
+written to a private temporary file and renamed into place, so a request never reads
+a half-written file. A file's mtime records when it was last used, and the least
+recently used files are evicted once the cache directory grows past its size limit.
+"""
+import logging
+import os
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def write_file_atomically(path, write):
+    """
+    Create path by calling write(tmp_path) on a temporary file in the same directory and
+    renaming it into place. The temporary file is removed if write raises.
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def mark_used(path):
+    """Touch a cached file so eviction treats it as recently used; returns whether it exists"""
+    try:
+        os.utime(path)
+        return True
+    except OSError:
+        return False
+
+
+def evict_lru_files(directory, extensions, max_bytes, max_age=None, keep=None):
+    """
+    Delete the files in directory ending with one of extensions that are older than
+    max_age seconds (if given), then the least recently used until the rest fit in
+    max_bytes. The file at `keep` (the entry about to be served) counts towards the
+    size but is never deleted. Returns the number of files deleted.
+    """
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith(extensions):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    cutoff = time.time() - max_age if max_age is not None else None
+    total_size = sum(size for _, size, _ in entries)
+    count = 0
+
+    # Oldest first, so expired entries and LRU victims come off the front
+    for mtime, size, path in sorted(entries):
+        if (cutoff is None or mtime >= cutoff) and total_size <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            total_size -= size
+            count += 1
+        except OSError as e:
+            logger.warning("Error deleting %s: %s", path, e)
+
+    return count
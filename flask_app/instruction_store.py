@@ -0,0 +1,367 @@
+"""
+Instruction Store
+
+Persistent storage for instruction records (the data behind each QR code's
+instruction page), keyed by instruction id. Three backends are available:
+
+- SqliteInstructionStore: one row per instruction in a WAL-mode SQLite database,
+  so saving or looking up one instruction doesn't touch the others
+- JsonInstructionStore: the original single instructions.json file, rewritten on
+  every save; kept for sites that need the plain JSON file
+- JournalInstructionStore: instructions.json as a snapshot plus an append-only
+  journal of changes, folded back into the snapshot by background compaction;
+  for sites that can't run SQLite
+
+All backends can export their contents in the instructions.json format, and are
+safe to share between threads and between worker processes: file writes are
+atomic renames made under an exclusive file lock, and each store has a version()
+that changes whenever any process saves, so in-memory copies can be invalidated.
+"""
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: stores are still thread safe, but not safe to share between processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def write_json_file(path, data):
+    """Write data as indented JSON in the instructions.json format, replacing the file atomically"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    
+    # Write to a private temporary file and rename it into place, so readers in
+    # other processes see either the old file or the new one, never half of one
+    fd, tmp_path = tempfile.mkstemp(suffix='.json.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class StoreLock:
+    """
+    Exclusive or shared lock on a lock file next to a store's data, held across
+    threads (an RLock) and worker processes (flock). The lock file also records a
+    generation, bumped by every write, and a compaction count, so other processes
+    can tell cheaply whether the data has changed since they last read it.
+    """
+
+    def __init__(self, path):
+        self.path = f"{path}.lock"
+        self.thread_lock = threading.RLock()
+        self.file = None
+        self.depth = 0
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+    @contextmanager
+    def hold(self, shared=False):
+        with self.thread_lock:
+            if self.depth == 0:
+                self.file = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644), 'r+')
+                if fcntl:
+                    fcntl.flock(self.file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            self.depth += 1
+            try:
+                yield
+            finally:
+                self.depth -= 1
+                if self.depth == 0:
+                    # Closing the file releases the flock
+                    self.file.close()
+                    self.file = None
+
+    def read_state(self):
+        """Return (generation, compactions), or None if the lock file is missing or mid-write"""
+        try:
+            with open(self.path, 'r') as f:
+                generation, compactions = f.read().split()
+            return int(generation), int(compactions)
+        except (OSError, ValueError):
+            return None
+
+    def bump(self, compacted=False):
+        """Record a write (and optionally a compaction); must be called while holding the lock"""
+        generation, compactions = self.read_state() or (0, 0)
+        # Fixed-width in-place write, so a concurrent read_state() never sees an empty file
+        self.file.seek(0)
+        self.file.write(f"{generation + 1:020d} {compactions + compacted:020d}")
+        self.file.flush()
+        return generation + 1, compactions + compacted
+
+
+class JsonInstructionStore:
+    """Stores every instruction in a single JSON file"""
+    name = 'json'
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = StoreLock(path)
+
+    def load_all(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def get(self, instruction_id):
+        return self.load_all().get(instruction_id)
+
+    def put(self, instruction_id, instruction_data):
+        self.put_many({instruction_id: instruction_data})
+
+    def put_many(self, instructions):
+        """Save instructions, returning the store version before and after the write"""
+        with self.lock.hold():
+            previous_version = self.version()
+            data = self.load_all()
+            data.update(instructions)
+            write_json_file(self.path, data)
+            return previous_version, self.lock.bump()
+
+    def version(self):
+        return self.lock.read_state()
+
+    def count(self):
+        return len(self.load_all())
+
+    def export_json(self, path):
+        write_json_file(path, self.load_all())
+
+
+class SqliteInstructionStore:
+    """Stores each instruction as a row in a SQLite database in WAL mode"""
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        with self.connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS instructions ('
+                ' id TEXT PRIMARY KEY,'
+                ' data TEXT NOT NULL,'
+                ' updated_at REAL NOT NULL)'
+            )
+            # Generation counter bumped by every write, so workers can spot each other's changes
+            conn.execute('CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute("INSERT OR IGNORE INTO store_meta (key, value) VALUES ('generation', 0)")
+
+    def connection(self):
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def load_all(self):
+        rows = self.connection().execute('SELECT id, data FROM instructions')
+        return {instruction_id: json.loads(data) for instruction_id, data in rows}
+
+    def get(self, instruction_id):
+        row = self.connection().execute(
+            'SELECT data FROM instructions WHERE id = ?', (instruction_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, instruction_id, instruction_data):
+        self.put_many({instruction_id: instruction_data})
+
+    def put_many(self, instructions):
+        """Save instructions, returning the store version before and after the write"""
+        now = time.time()
+        with self.connection() as conn:
+            # Take the write lock up front so the version read below can't go stale
+            conn.execute('BEGIN IMMEDIATE')
+            previous_version = self.version()
+            conn.executemany(
+                'INSERT INTO instructions (id, data, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at',
+                [(instruction_id, json.dumps(data), now) for instruction_id, data in instructions.items()]
+            )
+            conn.execute("UPDATE store_meta SET value = value + 1 WHERE key = 'generation'")
+            return previous_version, previous_version + 1
+
+    def version(self):
+        return self.connection().execute("SELECT value FROM store_meta WHERE key = 'generation'").fetchone()[0]
+
+    def count(self):
+        return self.connection().execute('SELECT COUNT(*) FROM instructions').fetchone()[0]
+
+    def export_json(self, path):
+        write_json_file(path, self.load_all())
+
+    def migrate_from_json(self, json_path):
+        """
+        One-shot import of an existing instructions.json into an empty database.
+        Returns the number of instructions imported.
+        """
+        if self.count() or not os.path.exists(json_path):
+            return 0
+        with open(json_path, 'r') as f:
+            instructions = json.load(f)
+        self.put_many(instructions)
+        return len(instructions)
+
+
+class JournalInstructionStore:
+    """
+    Keeps instructions.json as a snapshot and appends each save to a journal as one
+    JSON line, so a save is a small sequential append. Loading replays the journal
+    over the snapshot; a torn final line from a crash mid-append is ignored (and cut
+    off by the next save), so recovery always yields the last fully written state.
+    Once the journal holds compact_after entries it is folded into the snapshot in a
+    background thread. Each process keeps the replayed data in memory and catches up
+    by reading only the journal lines other processes have appended since.
+    """
+    name = 'journal'
+
+    def __init__(self, snapshot_path, journal_path, compact_after=500):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_after = compact_after
+        self.lock = StoreLock(snapshot_path)
+        self.compaction_thread = None
+        self.replay()
+
+    def replay(self):
+        """Load the snapshot and apply the whole journal to it"""
+        with self.lock.hold(shared=True):
+            self.state = self.lock.read_state()
+            self.data = {}
+            if os.path.exists(self.snapshot_path):
+                with open(self.snapshot_path, 'r') as f:
+                    self.data = json.load(f)
+            self.journal_offset = 0
+            self.journal_entries = 0
+            self.read_journal()
+
+    def read_journal(self):
+        """Apply complete journal lines from journal_offset onwards"""
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self.journal_offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Torn write from a crash mid-append
+                    break
+                entry = json.loads(line)
+                self.data[entry['id']] = entry['data']
+                self.journal_offset += len(line)
+                self.journal_entries += 1
+
+    def refresh(self):
+        """Catch up with saves made by other processes"""
+        with self.lock.thread_lock:
+            state = self.lock.read_state()
+            if state == self.state:
+                return
+            if state is None or self.state is None or state[1] != self.state[1]:
+                # The journal has been compacted into a new snapshot since we last read it
+                self.replay()
+            else:
+                with self.lock.hold(shared=True):
+                    self.state = self.lock.read_state()
+                    self.read_journal()
+
+    def load_all(self):
+        with self.lock.thread_lock:
+            self.refresh()
+            return dict(self.data)
+
+    def get(self, instruction_id):
+        with self.lock.thread_lock:
+            self.refresh()
+            return self.data.get(instruction_id)
+
+    def put(self, instruction_id, instruction_data):
+        self.put_many({instruction_id: instruction_data})
+
+    def put_many(self, instructions):
+        """Save instructions, returning the store version before and after the write"""
+        lines = ''.join(json.dumps({'id': instruction_id, 'data': data}) + '\n'
+                        for instruction_id, data in instructions.items())
+        with self.lock.hold():
+            previous_version = self.version()
+            self.refresh()
+            os.makedirs(os.path.dirname(self.journal_path) or '.', exist_ok=True)
+            with open(self.journal_path, 'a') as f:
+                # Anything past what we've read is a torn line left by a crashed writer
+                f.truncate(self.journal_offset)
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+                self.journal_offset = f.tell()
+            self.data.update(instructions)
+            self.journal_entries += len(instructions)
+            self.state = self.lock.bump()
+
+            if self.journal_entries >= self.compact_after and not self.compaction_running():
+                self.compaction_thread = threading.Thread(target=self.compact, daemon=True)
+                self.compaction_thread.start()
+            return previous_version, self.state
+
+    def compaction_running(self):
+        return self.compaction_thread is not None and self.compaction_thread.is_alive()
+
+    def compact(self):
+        """Fold the journal into a new snapshot and start an empty journal"""
+        with self.lock.hold():
+            self.refresh()
+            write_json_file(self.snapshot_path, self.data)
+            # The snapshot now contains every journalled change
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self.journal_offset = 0
+            self.journal_entries = 0
+            self.state = self.lock.bump(compacted=True)
+
+    def version(self):
+        return self.lock.read_state()
+
+    def count(self):
+        with self.lock.thread_lock:
+            self.refresh()
+            return len(self.data)
+
+    def export_json(self, path):
+        write_json_file(path, self.load_all())
+
+
+def create_instruction_store(backend, json_path, db_path, journal_path=None, journal_compact_after=500):
+    """
+    Create the instruction store for the configured backend ('sqlite', 'journal' or 'json').
+    A new SQLite store is seeded from the existing JSON file.
+    """
+    if backend == 'json':
+        return JsonInstructionStore(json_path)
+    if backend == 'journal':
+        return JournalInstructionStore(json_path, journal_path or f"{json_path}.journal", journal_compact_after)
+    if backend == 'sqlite':
+        store = SqliteInstructionStore(db_path)
+        migrated = store.migrate_from_json(json_path)
+        if migrated:
+            logger.info("Migrated %d instructions from %s to %s", migrated, json_path, db_path)
+        return store
+    raise ValueError(f"Unknown instruction store backend: {backend}")
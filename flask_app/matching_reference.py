@@ -0,0 +1,302 @@
+"""
+Matching Reference
+
+The medication to PDF and display name matching as it was before MedicationMatcher,
+copied unchanged, with its own copies of the mappings. `benchmarks.py pdf-match` checks
+the current matching against these functions and times both.
+"""
+
+
+def normalize_form(form_term):
+    """
+    Normalize form terms to handle aliases
+    """
+    form_aliases = {
+        "tablet": ["tablet", "tablets", "tabs", "tab"],
+        "capsule": ["capsule", "capsules", "caps", "cap"],
+        "inhaler": ["inhaler", "inhalator", "inhale", "inh"],
+        "spray": ["spray", "sprays"],
+        "liquid": ["liquid", "solution", "suspension", "syrup", "soln"],
+        "gel": ["gel", "jelly"],
+        "cream": ["cream", "crm", "ointment"],
+        "patch": ["patch", "patches", "plaster"]
+    }
+    
+    form_term = form_term.lower()
+    
+    # Check if the form term matches any of our known aliases
+    for normalized_form, aliases in form_aliases.items():
+        if form_term in aliases:
+            return normalized_form
+            
+    # If no match found, return the original term
+    return form_term
+
+
+def find_matching_pdf(medication_name, pdf_type):
+    """
+    Find the most appropriate PDF based on medication name and keywords.
+    pdf_type should be either 'leaflet' or 'pictorial'
+    """
+    # Convert medication name to lowercase for case-insensitive matching
+    med_name_lower = medication_name.lower()
+    
+    # Convert pdf_type to the correct folder name
+    pdf_folder = pdf_type + 's' if not pdf_type.endswith('s') else pdf_type
+    pdf_key = 'leaflet' if 'leaflet' in pdf_type else 'pictorial'
+    
+    # Define keyword mappings for medications
+    keyword_mappings = {
+        'paracetamol': {
+            'tablet': {
+                'leaflet': 'paracetamoltabletsleaflet.pdf',
+                'pictorial': 'Paracetamoltabletspictorial.pdf'
+            }
+        },
+        'salbutamol': {
+            'inhaler': {
+                'leaflet': 'Salbutamolinhalerleaflet.pdf',
+                'pictorial': 'Salbutamolinhalerpictorial.pdf'
+            }
+        },
+        'peptac': {
+            'suspension': {
+                'leaflet': 'peptacliquidleaflet.pdf',
+                'pictorial': 'peptacliquidpictorial.pdf'
+            },
+            'liquid': {
+                'leaflet': 'peptacliquidleaflet.pdf',
+                'pictorial': 'peptacliquidpictorial.pdf'
+            }
+        },
+        'amlodipine': {
+            'tablet': {
+                'leaflet': 'amlodipinetabletleaflet.pdf',
+                'pictorial': 'amlodipinetabletpictorial.pdf'
+            }
+        },
+        'atorvastatin': {
+            'tablet': {
+                'leaflet': 'atorvastatintabletleaflet.pdf',
+                'pictorial': 'atorvastatintabletpictorial.pdf'
+            }
+        },
+        'carbomer': {
+            'gel': {
+                'leaflet': 'carbomerleaflet.pdf',
+                'pictorial': 'carbomerpictorial.pdf'
+            }
+        },
+        'doxycycline': {
+            'capsule': {
+                'leaflet': 'doxycyclinecapsuleleaflet.pdf',
+                'pictorial': 'doxycyclinecapsulepictorial.pdf'
+            }
+        },
+        'esomeprazole': {
+            'tablet': {
+                'leaflet': 'esomeprazoletabletleaflet.pdf',
+                'pictorial': 'esomeprazoletabletpictorial.pdf'
+            }
+        },
+        'furosemide': {
+            'tablet': {
+                'leaflet': 'furosemidetabletleaflet.pdf',
+                'pictorial': 'furosemidetabletpictorial.pdf'
+            }
+        },
+        'lisinopril': {
+            'tablet': {
+                'leaflet': 'lisinopriltabletleaflet.pdf',
+                'pictorial': 'lisinopriltabletpictorial.pdf'
+            }
+        },
+        'metformin': {
+            'm/r tablet': {
+                'leaflet': 'metforminmrtabletleaflet.pdf',
+                'pictorial': 'metforminmrtabletpictorial.pdf'
+            }
+        },
+        'mirtazapine': {
+            'tablet': {
+                'leaflet': 'mirtazapinetabletleaflet.pdf',
+                'pictorial': 'mirtazapinetabletpictorial.pdf'
+            }
+        },
+        'prednisolone': {
+            'tablet': {
+                'leaflet': 'prednisolonetabletleaflet.pdf',
+                'pictorial': 'prednisolonetabletpictorial.pdf'
+            }
+        },
+        'trimbow': {
+            'mdi': {
+                'leaflet': 'trimbowpMDIleaflet.pdf',
+                'pictorial': 'trimbowpMDIpictorial.pdf'
+            }
+        },
+        # Added new medications
+        'gtn': {
+            'spray': {
+                'leaflet': 'gtnsprayleaflet.pdf',
+                'pictorial': 'gtnspraypictorial.pdf'
+            }
+        },
+        'fludrocortisone': {
+            'tablet': {
+                'leaflet': 'fludrocortisonetabletleaflet.pdf',
+                'pictorial': 'fludrocortisonetabletpictorial.pdf'
+            }
+        },
+        'apixaban': {
+            'tablet': {
+                'leaflet': 'apixabantabletleaflet.pdf',
+                'pictorial': 'apixabantabletpictorial.pdf'
+            }
+        },
+        'loperamide': {
+            'capsule': {
+                'leaflet': 'loperamidecapsuleleaflet.pdf',
+                'pictorial': 'loperamidecapsulepictorial.pdf'
+            }
+        },
+        'amiodarone': {
+            'tablet': {
+                'leaflet': 'amiodaronetabletleaflet.pdf',
+                'pictorial': 'amiodaronetabletpictroial.pdf'  # Corrected to match actual filename
+            }
+        }
+    }
+    
+    # Track the best match and its score
+    best_match = None
+    best_score = 0
+    
+    # Determine which type of PDF we're looking for
+    pdf_key = 'leaflet' if 'leaflet' in pdf_type else 'pictorial'
+    
+    # Check each medication keyword
+    for med_key, formulations in keyword_mappings.items():
+        if med_key in med_name_lower:
+            # Found a medication match, now check formulations
+            for form_key, pdf_info in formulations.items():
+                normalized_form = normalize_form(form_key)
+                # Check if any form term (or its alias) is in the med name
+                if any(alias in med_name_lower for alias in [
+                    form_key, 
+                    normalized_form, 
+                    f"{normalized_form}s", 
+                    f"{normalized_form[0:3]}", 
+                    f"{normalized_form[0:3]}s"
+                ]) or (form_key == 'tablet' and 'tab' in med_name_lower) or (form_key == 'capsule' and 'cap' in med_name_lower):
+                    # Both medication and formulation match - this is a perfect match
+                    return pdf_info[pdf_key] if pdf_key in pdf_info else None
+                else:
+                    # Only medication matches, keep track of it as a potential match
+                    # Score of 1 for medication match
+                    if 1 > best_score:
+                        best_score = 1
+                        best_match = list(formulations.values())[0][pdf_key]
+    
+    # If we found any match, return it
+    if best_match:
+        return best_match
+    
+    # No match found, return None
+    return None
+
+
+def get_formatted_medication_name(med_name):
+    """
+    Get a properly formatted medication name with formulation details.
+    """
+    med_name_lower = med_name.lower()
+    
+    # Define medication mappings with their proper names and formulations
+    medication_mappings = {
+        'salbutamol': {
+            'mdi': 'Salbutamol pMDI inhaler',
+            'inhaler': 'Salbutamol pMDI inhaler',
+        },
+        'trimbow': {
+            'pMDI': 'Trimbow pMDI inhaler',
+            'inhaler': 'Trimbow pMDI inhaler'
+        },
+        'doxycycline': {
+            'capsule': 'Doxycycline capsules',
+        },
+        'esomeprazole': {
+            'tablet': 'Esomeprazole tablets',
+        },
+        'furosemide': {
+            'tablet': 'Furosemide tablets',
+        },
+        'lisinopril': {
+            'tablet': 'Lisinopril tablets'
+        },
+        'metformin': {
+            'm/r tablet': 'Metformin modified-release tablets',
+        },
+        'mirtazapine': {
+            'tablet': 'Mirtazapine tablets',
+        },
+        'prednisolone': {
+            'tablet': 'Prednisolone tablets',
+        },
+        'paracetamol': {
+            'tablet': 'Paracetamol tablets',
+        },
+        'peptac': {
+            'suspension': 'Peptac liquid',
+            'liquid': 'Peptac liquid'
+        },
+        'amlodipine': {
+            'tablet': 'Amlodipine tablets'
+        },
+        'atorvastatin': {
+            'tablet': 'Atorvastatin tablets'
+        },
+        'carbomer': {
+            'gel': 'Carbomer eye gel'
+        },
+        # Added new medications
+        'gtn': {
+            'spray': 'GTN spray'
+        },
+        'fludrocortisone': {
+            'tablet': 'Fludrocortisone tablets'
+        },
+        'apixaban': {
+            'tablet': 'Apixaban tablets'
+        },
+        'loperamide': {
+            'capsule': 'Loperamide capsules'
+        },
+        'amiodarone': {
+            'tablet': 'Amiodarone tablets'
+        }
+    }
+    
+    # Find the medication in our mappings
+    for med_key, formulations in medication_mappings.items():
+        if med_key in med_name_lower:
+            # Found a medication match, now check formulations
+            for form_key, formatted_name in formulations.items():
+                normalized_form = normalize_form(form_key)
+                # Check for form aliases
+                if any(alias in med_name_lower for alias in [
+                    form_key, 
+                    normalized_form, 
+                    f"{normalized_form}s", 
+                    f"{normalized_form[0:3]}", 
+                    f"{normalized_form[0:3]}s"
+                ]):
+                    # Both medication and formulation match
+                    return formatted_name
+            
+            # If no formulation match but medication matches, return the first formulation
+            if formulations:
+                return list(formulations.values())[0]
+    
+    # If no match found, return the original name
+    return med_name
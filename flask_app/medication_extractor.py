@@ -0,0 +1,287 @@
+"""
+Medication Extractor
+
+Server-side port of extractMedicationsFromDischargeLetter() in
+static/js/medication-extractor.js. Regular expressions are compiled once at import
+so letters can be bulk-processed without recompiling them for every entry.
+The returned medication dicts use the same field names as the JavaScript objects.
+"""
+import re
+
+START_TRIGGER = "Medications Prescribed on Discharge"
+END_TRIGGERS = [
+    "Dose Changes:",
+    "DOSE CHANGES:",
+    "Medications Started in Hospital Comment:",
+    "Medications Stopped in Hospital Comment:",
+    "Take Home Medications Comment:",
+    "Treatment recommendation (For GP):",
+    "Information for the Community Pharmacy:",
+    "TTO Completed by Ward Pharmacist?:",
+    "Medications Authorised by::",
+]
+
+# Indented lines under a medication that mean it should be preselected
+TRIGGER_PHRASES = ('Existing Med', 'New Med', 'Hospital Supply', 'GP to Review')
+
+# JavaScript's \w only matches ASCII word characters, so the ASCII flag keeps parity
+INDENTED_LINE_REGEX = re.compile(r'^\s+\S')
+MEDICATION_REGEX = re.compile(r'^([^\[]+)\s*(?:(\d+(?:\.\d+)?%))?\s*\[(.*?)\],\s+(.*)')
+STRENGTH_REGEX = re.compile(
+    r'(\d+(?:,\d+)?(?:\.\d+)?)\s*(\w+)?(?:\s*/\s*(\d+(?:,\d+)?(?:\.\d+)?)\s*(\w+)?)?', re.I | re.A)
+FORM_REGEX = re.compile(
+    r'(?:tablet|sprays|spray|tabs|caplet|oral\s+solution|oral\s+son\.|capsule|tab|caps|cap|inhalator|patch|'
+    r'capsule/tablet|inhaler|flexpen|cartridge|sach|sachet|cream|crm|ointment|Scalp Application|sudocrem|'
+    r'lotion|gel|liquid gel|nebule|nebules|nebs|amps|solution|syrup|suspension|oral solution|oral soln\.|'
+    r'liquid|elixir|linctus|s/f oral soln\.|oral powder|drop|drops|lozenge|gum)', re.I)
+DOSE_RANGE_REGEX = re.compile(r'(\d+(?:,\d+)*(?:\.\d+)?)\s*(?:-\s*(\d+(?:,\d+)*(?:\.\d+)?))?\s*(\w+)?', re.I | re.A)
+DOSE_REGEX = re.compile(r'(\d+(?:,\d+)*(?:\.\d+)?)\s*(\w+)', re.I | re.A)
+DOSE_QUANTITY_REGEX = re.compile(r'(\d+(?:\.\d+)?)\s+(tab|tablet|capsule|cap)', re.I)
+SPRAY_COUNT_REGEX = re.compile(r'(\d+(?:\.\d+)?)\s*(?:spray|sprays)', re.I)
+TAPER_TABLE_REGEX = re.compile(r'Dose\s+Frequency\s+Days\s+Hours\s+From\s+Through\s*\n((?:.*\n?)*)')
+SCOPODERM_DOSE_REGEX = re.compile(r'(\d+(?:\.\d+)?)\s*mg')
+FREQUENCY_REGEX = re.compile(
+    r'(once|twice|three times|four times|1 time|2 times|3 times|4 times)'
+    r'(?:\s+a\s+day|\s+daily|\s+every\s+day|\s+per\s+day)?', re.I)
+CONDITION_REGEX = re.compile(r'for\s+([\w\s]+?)(?:\.|,|$)', re.I | re.A)
+
+# Extracted form terms that are reported under a canonical name
+FORM_CANONICAL_NAMES = {
+    'sach': 'sachet',
+    'tab': 'tablet',
+    'cap': 'capsule',
+    'oral powder': 'sachet',
+    'drops': 'drop',
+    'scalp application': 'cream',
+}
+
+TABLET_FORMS = ('tablet', 'capsule', 'tab', 'cap')
+UNIT_DOSE_UNITS = ('tab', 'tablet', 'capsule', 'cap', 'half tab', 'half tablet', 'half capsule', 'half cap')
+
+SOME_DAYS_PHRASES = (
+    'once a week', 'once week', 'twice a week', '3 x week', '6 days of week', 'every 72 hours',
+    'alternate', 'month', 'every 3 days', 'once only one'
+)
+
+
+def parse_number(text):
+    """Parse a number the way JavaScript's parseFloat does for these patterns, ignoring commas"""
+    value = float(text.replace(',', ''))
+    return int(value) if value.is_integer() else value
+
+
+def split_medication_entries(medication_section):
+    """
+    Split the medication section into entries, keeping indented lines
+    associated with the medication entry above them
+    """
+    entries = []
+    current_entry = ''
+    current_indented_lines = []
+
+    for line in medication_section.split('\n'):
+        # If the line starts with spaces and is not empty, it's an indented line
+        if INDENTED_LINE_REGEX.match(line) and line.strip():
+            current_indented_lines.append(line)
+        # If the line doesn't start with spaces or is empty, it's a new entry
+        else:
+            if current_entry:
+                entries.append((current_entry, current_indented_lines))
+                current_indented_lines = []
+            current_entry = line if line.strip() else ''
+
+    # Add the last entry if there is one
+    if current_entry:
+        entries.append((current_entry, current_indented_lines))
+
+    return entries
+
+
+def parse_medication_entry(entry, indented_lines):
+    """Parse a single medication entry line, returning None if it isn't a medication"""
+    match = MEDICATION_REGEX.search(entry)
+    if match:
+        # Logic for medications with square brackets
+        name = match.group(1).strip()
+        percentage = match.group(2) or ''
+        dosage = match.group(3)
+        instructions = match.group(4)
+        name = name + (' ' + percentage if percentage else '') + ' [' + dosage + ']'
+    else:
+        # Logic for medications without square brackets
+        parts = entry.split(',')
+        if len(parts) < 2:
+            return None
+        name = parts[0].strip()
+        dosage = name
+        instructions = ','.join(parts[1:]).strip()
+
+    instructions_lower = instructions.lower()
+
+    strength_unit = None
+    strength_volume = 1
+    strength_volume_unit = None
+    strength_match = STRENGTH_REGEX.search(dosage)
+    if strength_match:
+        strength1 = parse_number(strength_match.group(1))
+        strength_unit = (strength_match.group(2) or '').lower()
+        if strength_match.group(3):
+            strength2 = parse_number(strength_match.group(3))
+            strength_volume_unit = strength_match.group(4).lower() if strength_match.group(4) else None
+            if strength_volume_unit == 'ml':
+                strength = strength1
+                strength_volume = strength2
+            else:
+                strength = strength1 + strength2
+        else:
+            strength = strength1
+    else:
+        strength = None
+
+    form_match = FORM_REGEX.search(dosage)
+    form = form_match.group(0).lower() if form_match else None
+    form = FORM_CANONICAL_NAMES.get(form, form)
+
+    dose_range_match = DOSE_RANGE_REGEX.search(instructions)
+    if dose_range_match:
+        min_dose = parse_number(dose_range_match.group(1))
+        max_dose = parse_number(dose_range_match.group(2)) if dose_range_match.group(2) is not None else min_dose
+        dose_unit = dose_range_match.group(3).lower() if dose_range_match.group(3) else 'units'
+    else:
+        min_dose = max_dose = dose_unit = None
+
+    if 'see taper' in instructions_lower:
+        min_dose = max_dose = dose_unit = None
+
+    if not min_dose or not max_dose:
+        dose_match = DOSE_REGEX.search(instructions)
+        min_dose = parse_number(dose_match.group(1)) if dose_match else None
+        max_dose = min_dose
+        dose_unit = dose_match.group(2).lower() if dose_match else None
+
+    dose_quantity_match = DOSE_QUANTITY_REGEX.search(instructions)
+    if dose_quantity_match:
+        min_dose = parse_number(dose_quantity_match.group(1))
+        max_dose = min_dose
+        dose_unit = dose_quantity_match.group(2).lower()
+        if min_dose == 0.5:
+            dose_unit = 'half ' + dose_unit
+            min_dose = max_dose = 1
+
+    # Convert a dose in mg (etc.) into a number of tablets/capsules
+    if min_dose and strength and form in TABLET_FORMS and dose_unit not in UNIT_DOSE_UNITS:
+        min_dose = min_dose / strength
+        max_dose = max_dose / strength
+
+    spray_count_match = SPRAY_COUNT_REGEX.search(instructions)
+    spray_count = parse_number(spray_count_match.group(1)) if spray_count_match else None
+
+    is_taper = 'taper' in instructions_lower or 'prescriber determined' in entry.lower()
+
+    taper_instructions = None
+    if is_taper:
+        taper_table_match = TAPER_TABLE_REGEX.search(entry)
+        if taper_table_match:
+            taper_instructions = taper_table_match.group(1).strip()
+
+    if 'scopoderm tts' in name.lower():
+        dose_match = SCOPODERM_DOSE_REGEX.search(instructions)
+        # Default to 1mg if no dose specified
+        min_dose = max_dose = parse_number(dose_match.group(1)) if dose_match else 1
+        # Each patch is 1mg
+        strength = 1
+        strength_unit = 'mg'
+        form = 'patch'
+
+    # Extract frequency information
+    frequency = ''
+    frequency_match = FREQUENCY_REGEX.search(instructions)
+    if frequency_match:
+        frequency = frequency_match.group(0)
+    elif 'daily' in instructions_lower:
+        frequency = 'once daily'
+    elif 'twice a day' in instructions_lower:
+        frequency = 'twice a day'
+    elif 'three times a day' in instructions_lower:
+        frequency = 'three times a day'
+    elif 'four times a day' in instructions_lower:
+        frequency = 'four times a day'
+
+    # Extract timing information
+    timing = []
+    if 'morning' in instructions_lower:
+        timing.append('morning')
+    if 'afternoon' in instructions_lower:
+        timing.append('afternoon')
+    if 'evening' in instructions_lower:
+        timing.append('evening')
+    if 'night' in instructions_lower or 'bedtime' in instructions_lower:
+        timing.append('night')
+
+    # Extract with/without food information
+    with_food = ''
+    if 'with food' in instructions_lower or 'after food' in instructions_lower or 'after meals' in instructions_lower:
+        with_food = 'with food'
+    elif ('without food' in instructions_lower or 'before food' in instructions_lower
+          or 'on empty stomach' in instructions_lower):
+        with_food = 'without food'
+
+    # Extract purpose/condition information
+    condition_match = CONDITION_REGEX.search(instructions)
+    condition = condition_match.group(1).strip() if condition_match else ''
+
+    should_preselect = any(line.strip().startswith(TRIGGER_PHRASES) for line in indented_lines)
+
+    return {
+        'name': name,
+        'dosage': dosage,
+        'instructions': instructions,
+        'strength': strength,
+        'strengthVolume': strength_volume,
+        'strengthVolumeUnit': strength_volume_unit,
+        'strengthUnit': strength_unit,
+        'form': form,
+        'minDose': min_dose,
+        'maxDose': max_dose,
+        'doseUnit': dose_unit,
+        'sprayCount': spray_count,
+        'frequency': frequency,
+        'timing': ' '.join(timing),
+        'withFood': with_food,
+        'condition': condition,
+        'shouldPreselect': should_preselect,
+        # Only mark as PRN if not a taper
+        'isPrn': ('prn' in instructions_lower or 'when required' in instructions_lower
+                  or 'as required' in instructions_lower) and not is_taper,
+        'isTaper': is_taper,
+        'taperInstructions': taper_instructions,
+        'isOmitMon': 'omit mon' in instructions_lower,
+        'isSomeDays': any(phrase in instructions_lower for phrase in SOME_DAYS_PHRASES),
+        'isExcludedFromCharts': 'Stationery [Steroid Emergency Card]' in name,
+    }
+
+
+def extract_medications_from_discharge_letter(discharge_letter_text):
+    """
+    Extract medication data from a discharge letter.
+    Returns a list of medication dicts, empty if the letter has no discharge medication section.
+    """
+    start_index = discharge_letter_text.find(START_TRIGGER)
+    if start_index == -1:
+        return []
+
+    # Find the end of the medication section
+    end_index = len(discharge_letter_text)
+    for trigger in END_TRIGGERS:
+        trigger_index = discharge_letter_text.find(trigger, start_index)
+        if trigger_index != -1 and trigger_index < end_index:
+            end_index = trigger_index
+
+    medication_section = discharge_letter_text[start_index + len(START_TRIGGER):end_index].strip()
+
+    medications = []
+    for entry, indented_lines in split_medication_entries(medication_section):
+        medication = parse_medication_entry(entry, indented_lines)
+        if medication:
+            medications.append(medication)
+    return medications
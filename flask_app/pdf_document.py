@@ -0,0 +1,100 @@
+"""
+PDF Document
+
+A minimal PDF writer for documents the application draws itself (vector QR codes and
+sticker sheets), where going through Pillow or PyPDF2 would be wasted work. Objects
+are written to the output as soon as they are added, so memory use stays bounded by
+the largest single object rather than the whole document.
+"""
+import zlib
+
+# Widths of the standard Helvetica font (1/1000 em) for printable ASCII, used to
+# measure and centre labels without embedding a font
+HELVETICA_WIDTHS = dict(zip(
+    (chr(code) for code in range(32, 127)),
+    (278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+     556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+     1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+     667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+     333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+     556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584)
+))
+DEFAULT_CHAR_WIDTH = 556
+
+HELVETICA_FONT = b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>'
+
+
+def text_width(text, font_size):
+    """Width of text set in Helvetica at font_size, in points"""
+    return sum(HELVETICA_WIDTHS.get(char, DEFAULT_CHAR_WIDTH) for char in text) * font_size / 1000
+
+
+def pdf_string(text):
+    """Encode text as a PDF literal string in WinAnsiEncoding"""
+    encoded = text.encode('cp1252', errors='replace')
+    return b'(' + encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def number(value):
+    """Format a coordinate compactly"""
+    return f"{value:.3f}".rstrip('0').rstrip('.')
+
+
+class PdfDocument:
+    """
+    Writes a PDF to a binary file object. Reserve object numbers up front with
+    reserve() when objects need to refer to each other, write them with add(),
+    then call finish() with the page object numbers.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.offsets = {}
+        self.next_number = 1
+        self.position = 0
+        self.pages_number = self.reserve()
+        self.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def write(self, data):
+        self.output.write(data)
+        self.position += len(data)
+
+    def reserve(self):
+        object_number = self.next_number
+        self.next_number += 1
+        return object_number
+
+    def add(self, body, object_number=None):
+        """Write an object (a bytes dictionary or value) and return its object number"""
+        if object_number is None:
+            object_number = self.reserve()
+        self.offsets[object_number] = self.position
+        self.write(f"{object_number} 0 obj\n".encode() + body + b'\nendobj\n')
+        return object_number
+
+    def add_stream(self, dictionary, data, object_number=None, compress=True):
+        """Write a stream object; dictionary is the entries between << and >> without /Length"""
+        if compress:
+            data = zlib.compress(data)
+            dictionary += b' /Filter /FlateDecode'
+        body = b'<< ' + dictionary + f" /Length {len(data)} >>\nstream\n".encode() + data + b'\nendstream'
+        return self.add(body, object_number)
+
+    def add_page(self, width, height, contents, resources, object_number=None):
+        """Write a page object whose content stream is the object number contents"""
+        body = (f"<< /Type /Page /Parent {self.pages_number} 0 R /MediaBox [0 0 {number(width)} "
+                f"{number(height)}] /Contents {contents} 0 R /Resources ").encode() + resources + b' >>'
+        return self.add(body, object_number)
+
+    def finish(self, page_numbers):
+        kids = ' '.join(f"{page} 0 R" for page in page_numbers)
+        self.add(f"<< /Type /Pages /Kids [{kids}] /Count {len(page_numbers)} >>".encode(), self.pages_number)
+        catalog = self.add(f"<< /Type /Catalog /Pages {self.pages_number} 0 R >>".encode())
+
+        xref_offset = self.position
+        lines = [f"xref\n0 {self.next_number}\n", "0000000000 65535 f \n"]
+        for object_number in range(1, self.next_number):
+            lines.append(f"{self.offsets[object_number]:010d} 00000 n \n")
+        lines.append(f"trailer\n<< /Size {self.next_number} /Root {catalog} 0 R >>\n"
+                     f"startxref\n{xref_offset}\n%%EOF\n")
+        self.write(''.join(lines).encode())
@@ -0,0 +1,263 @@
+"""
+QR Renderer
+
+Renders the labelled QR code images that link to instruction pages. A QRRenderer
+holds the QR settings and the label font, loaded once rather than for every image,
+and builds each image straight from the QR module matrix. Matrices are cached by
+URL, since choosing the mask pattern is most of the cost of a QR code. Whole
+medication lists can be rendered in one call, optionally spread over a thread or
+process pool.
+
+Images can be rendered as PNG or, straight from the matrix without Pillow, as SVG
+or PDF vector drawings, which are smaller and print crisply at any size.
+Each render has a key hashed from its inputs (URL, label, format and render
+settings), used to cache rendered images and as their ETag.
+"""
+import hashlib
+import io
+import json
+import threading
+from xml.sax.saxutils import escape
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+
+import qrcode
+from PIL import Image, ImageDraw, ImageFont
+
+from pdf_document import HELVETICA_FONT, PdfDocument, number, pdf_string, text_width
+
+# Height of the white strip under the QR code that holds the medication name
+LABEL_HEIGHT = 40
+LABEL_TEXT_OFFSET = 10
+
+# Bump when a change to the rendering code changes the images, so cached images are re-rendered
+RENDER_FORMAT_VERSION = 1
+
+IMAGE_FORMATS = ('png', 'svg', 'pdf')
+
+# PDF output is sized as the PNG would print at 96 dpi
+PDF_POINTS_PER_PIXEL = 0.75
+
+
+def matrix_runs(matrix):
+    """Yield (x, y, length) for each horizontal run of dark modules"""
+    for y, row in enumerate(matrix):
+        x = 0
+        modules = len(row)
+        while x < modules:
+            if row[x]:
+                run_start = x
+                while x < modules and row[x]:
+                    x += 1
+                yield run_start, y, x - run_start
+            else:
+                x += 1
+
+
+class QRRenderer:
+    """Renders QR code images for URLs, with an optional text label underneath"""
+
+    def __init__(self, box_size=10, border=4, error_correction=qrcode.constants.ERROR_CORRECT_L,
+                 font_name="Arial", font_size=16, matrix_cache_size=1024):
+        self.box_size = box_size
+        self.border = border
+        self.error_correction = error_correction
+        self.font_name = font_name
+        self.font_size = font_size
+        self.matrix_cache_size = matrix_cache_size
+        self.local = threading.local()
+        self.font = self.load_font()
+        self.get_matrix = lru_cache(maxsize=matrix_cache_size)(self.build_matrix)
+        self.pdf_drawing = lru_cache(maxsize=matrix_cache_size)(self.build_pdf_drawing)
+
+    def settings(self):
+        """Constructor arguments, used to rebuild an identical renderer in a worker process"""
+        return (self.box_size, self.border, self.error_correction, self.font_name, self.font_size,
+                self.matrix_cache_size)
+
+    def render_key(self, url, label='', image_format='png'):
+        """Hash of everything that determines the rendered image"""
+        inputs = [RENDER_FORMAT_VERSION, self.box_size, self.border, self.error_correction,
+                  self.font_name, self.font_size, url, label, image_format]
+        return hashlib.sha256(json.dumps(inputs).encode('utf-8')).hexdigest()
+
+    def load_font(self):
+        try:
+            return ImageFont.truetype(self.font_name, self.font_size)
+        except IOError:
+            return ImageFont.load_default()
+
+    def get_qr(self):
+        """Get this thread's QRCode object, cleared for reuse"""
+        qr = getattr(self.local, 'qr', None)
+        if qr is None:
+            qr = qrcode.QRCode(
+                version=1,
+                error_correction=self.error_correction,
+                box_size=self.box_size,
+                border=self.border,
+            )
+            self.local.qr = qr
+        else:
+            qr.clear()
+            # make(fit=True) grows the version, so start again from the smallest
+            qr.version = 1
+        return qr
+
+    def build_matrix(self, url):
+        """Module matrix for the URL (True = dark), including the quiet-zone border"""
+        qr = self.get_qr()
+        qr.add_data(url)
+        qr.make(fit=True)
+        return tuple(tuple(row) for row in qr.get_matrix())
+
+    def render(self, url, label=''):
+        """Render the QR code for the URL as a PIL image, with the label centred below it"""
+        matrix = self.get_matrix(url)
+        modules = len(matrix)
+
+        # One pixel per module, then scaled up, instead of drawing each module as a rectangle
+        qr_img = Image.new('1', (modules, modules))
+        qr_img.putdata([0 if dark else 1 for row in matrix for dark in row])
+        size = modules * self.box_size
+        qr_img = qr_img.resize((size, size), Image.NEAREST)
+
+        if not label:
+            return qr_img
+
+        # Greyscale holds black text on white exactly and encodes about 3x faster than RGB
+        labelled_img = Image.new('L', (size, size + LABEL_HEIGHT), 255)
+        labelled_img.paste(qr_img, (0, 0))
+        draw = ImageDraw.Draw(labelled_img)
+        text_width = draw.textlength(label, font=self.font)
+        draw.text(((size - text_width) // 2, size + LABEL_TEXT_OFFSET), label, fill=0, font=self.font)
+        return labelled_img
+
+    def render_png(self, url, label=''):
+        """Render the QR code for the URL as PNG bytes"""
+        buffer = io.BytesIO()
+        self.render(url, label).save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    def render_svg(self, url, label=''):
+        """Render the QR code for the URL as SVG bytes, drawn in module units and scaled to box_size"""
+        matrix = self.get_matrix(url)
+        modules = len(matrix)
+
+        # Each horizontal run of dark modules is a one-module-wide stroke along the middle
+        # of its row, moving relatively between runs on the same row to keep the path short
+        path = []
+        row = pen_x = None
+        for x, y, length in matrix_runs(matrix):
+            if y == row:
+                path.append(f"m{x - pen_x} 0h{length}")
+            else:
+                path.append(f"M{x} {y}.5h{length}")
+                row = y
+            pen_x = x + length
+
+        size = modules * self.box_size
+        height_units = modules + (LABEL_HEIGHT / self.box_size if label else 0)
+        parts = [
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{round(height_units * self.box_size)}" '
+            f'viewBox="0 0 {modules} {height_units:g}" shape-rendering="crispEdges">',
+            f'<rect width="{modules}" height="{height_units:g}" fill="#fff"/>',
+            f'<path d="{"".join(path)}" stroke="#000"/>',
+        ]
+        if label:
+            baseline = modules + (LABEL_TEXT_OFFSET + self.font_size * 0.8) / self.box_size
+            parts.append(
+                f'<text x="{modules / 2:g}" y="{baseline:g}" font-family="{escape(self.font_name)}, sans-serif" '
+                f'font-size="{self.font_size / self.box_size:g}" text-anchor="middle">{escape(label)}</text>'
+            )
+        parts.append('</svg>')
+        return ''.join(parts).encode('utf-8')
+
+    def build_pdf_drawing(self, url, label=''):
+        """
+        PDF content stream operators drawing the QR code (and label) with its origin at
+        the bottom left, plus its (width, height) in points. Used as a page's contents
+        or as a Form XObject; the label needs the Helvetica font as resource /F1.
+        Cached per (url, label) as pdf_drawing().
+        """
+        matrix = self.get_matrix(url)
+        modules = len(matrix)
+        module_size = self.box_size * PDF_POINTS_PER_PIXEL
+        width = modules * module_size
+        label_height = LABEL_HEIGHT * PDF_POINTS_PER_PIXEL if label else 0
+        height = width + label_height
+
+        # Modules are drawn in module units, top row first, by flipping the y axis
+        operators = [
+            f"1 g 0 0 {number(width)} {number(height)} re f 0 g",
+            f"q {number(module_size)} 0 0 {number(-module_size)} 0 {number(height)} cm",
+        ]
+        operators.extend(f"{x} {y} {length} 1 re" for x, y, length in matrix_runs(matrix))
+        operators.append("f Q")
+
+        drawing = '\n'.join(operators).encode('ascii')
+        if label:
+            font_size = self.font_size * PDF_POINTS_PER_PIXEL
+            baseline = label_height - (LABEL_TEXT_OFFSET + self.font_size * 0.8) * PDF_POINTS_PER_PIXEL
+            text_x = (width - text_width(label, font_size)) / 2
+            drawing += (f"\nBT /F1 {number(font_size)} Tf {number(text_x)} {number(baseline)} Td ".encode('ascii')
+                        + pdf_string(label) + b' Tj ET')
+        return drawing, width, height
+
+    def render_pdf(self, url, label=''):
+        """Render the QR code for the URL as a one-page vector PDF"""
+        drawing, width, height = self.pdf_drawing(url, label)
+        buffer = io.BytesIO()
+        document = PdfDocument(buffer)
+        font = document.add(HELVETICA_FONT)
+        contents = document.add_stream(b'', drawing)
+        page = document.add_page(width, height, contents, f"<< /Font << /F1 {font} 0 R >> >>".encode())
+        document.finish([page])
+        return buffer.getvalue()
+
+    def render_image(self, url, label='', image_format='png'):
+        """Render the QR code for the URL as 'png', 'svg' or 'pdf' bytes"""
+        if image_format == 'svg':
+            return self.render_svg(url, label)
+        if image_format == 'pdf':
+            return self.render_pdf(url, label)
+        if image_format == 'png':
+            return self.render_png(url, label)
+        raise ValueError(f"Unknown QR image format: {image_format}")
+
+    def render_batch(self, jobs, executor=None, image_format='png'):
+        """
+        Render a list of (url, label) jobs to image bytes, in order. Pass a
+        ThreadPoolExecutor or ProcessPoolExecutor to spread the batch over its workers.
+        """
+        jobs = list(jobs)
+        if executor is None or len(jobs) < 2:
+            return [self.render_image(url, label, image_format) for url, label in jobs]
+        if isinstance(executor, ProcessPoolExecutor):
+            settings = self.settings()
+            return list(executor.map(render_image_job, [(settings, url, label, image_format) for url, label in jobs],
+                                     chunksize=max(1, len(jobs) // 16)))
+        return list(executor.map(lambda job: self.render_image(*job, image_format), jobs))
+
+
+def create_render_executor(pool, workers=None):
+    """Create a 'thread' or 'process' pool for render_batch, or None to render in the calling thread"""
+    if not pool:
+        return None
+    if pool == 'thread':
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='qr-render')
+    if pool == 'process':
+        return ProcessPoolExecutor(max_workers=workers)
+    raise ValueError(f"Unknown QR render pool: {pool}")
+
+
+@lru_cache(maxsize=8)
+def get_renderer(settings):
+    """Renderer for the given settings, built once per worker process"""
+    return QRRenderer(*settings)
+
+
+def render_image_job(job):
+    """Process pool entry point: render one (settings, url, label, image_format) job to image bytes"""
+    settings, url, label, image_format = job
+    return get_renderer(settings).render_image(url, label, image_format)
@@ -0,0 +1,170 @@
+"""
+QR Stickers
+
+Lays out QR code stickers on A4 label sheets as a vector PDF, matching the label
+grid the chart generator prints client-side: a QR code on the left of each label,
+with the medication name and a "Scan for instructions" note beside it.
+
+Each distinct QR code is drawn once as a Form XObject and placed on every label that
+uses it, and pages are written to the output as they are laid out, so a ward batch
+of hundreds of stickers needs no more memory than one page.
+"""
+import math
+
+from pdf_document import HELVETICA_FONT, PdfDocument, number, pdf_string, text_width
+
+MM = 72 / 25.4
+A4_WIDTH = 210 * MM
+A4_HEIGHT = 297 * MM
+
+# Label sheet layouts, in millimetres. 'a4-24' is the sheet chartgenerator.html prints on.
+STICKER_LAYOUTS = {
+    'a4-24': {'columns': 3, 'rows': 8, 'label_width': 63.5, 'label_height': 34,
+              'top_margin': 13, 'left_margin': 7, 'column_gap': 2.5, 'row_gap': 0},
+    'a4-21': {'columns': 3, 'rows': 7, 'label_width': 63.5, 'label_height': 38.1,
+              'top_margin': 15.1, 'left_margin': 7.2, 'column_gap': 2.5, 'row_gap': 0},
+}
+DEFAULT_STICKER_LAYOUT = 'a4-24'
+
+LABEL_PADDING = 1.3 * MM
+QR_SIZE = 24 * MM
+TEXT_GAP = 3 * MM
+NAME_FONT_SIZE = 9
+NAME_LINE_HEIGHT = 11
+NAME_MAX_LINES = 3
+NOTE_FONT_SIZE = 6
+NOTE_TEXT = "Scan for instructions"
+
+
+def get_sticker_layout(name=None, overrides=None):
+    """
+    Look up a named layout and apply any overrides (e.g. {'rows': 7}).
+    Raises ValueError for an unknown layout, setting or a grid that doesn't fit on A4.
+    """
+    name = name or DEFAULT_STICKER_LAYOUT
+    if name not in STICKER_LAYOUTS:
+        raise ValueError(f"Unknown sticker layout: {name}")
+    layout = dict(STICKER_LAYOUTS[name])
+
+    for key, value in (overrides or {}).items():
+        if key not in layout:
+            raise ValueError(f"Unknown sticker layout setting: {key}")
+        # NaN compares false with everything, so it would pass every range check below
+        if not isinstance(value, (int, float)) or not math.isfinite(value) or value < 0:
+            raise ValueError(f"Sticker layout setting {key} must be a finite, non-negative number")
+        layout[key] = int(value) if key in ('columns', 'rows') else float(value)
+
+    if layout['columns'] < 1 or layout['rows'] < 1:
+        raise ValueError("Sticker layout needs at least one column and one row")
+    width = (layout['left_margin'] + layout['columns'] * layout['label_width']
+             + (layout['columns'] - 1) * layout['column_gap'])
+    height = (layout['top_margin'] + layout['rows'] * layout['label_height']
+              + (layout['rows'] - 1) * layout['row_gap'])
+    if width > 210 or height > 297:
+        raise ValueError("Sticker layout does not fit on an A4 page")
+    return layout
+
+
+def wrap_text(text, font_size, max_width, max_lines):
+    """Word-wrap text to lines no wider than max_width, ending with '...' if it doesn't fit"""
+    lines = []
+    current = ''
+    for word in text.split():
+        candidate = f"{current} {word}" if current else word
+        if text_width(candidate, font_size) <= max_width or not current:
+            current = candidate
+        else:
+            lines.append(current)
+            current = word
+    if current:
+        lines.append(current)
+
+    if len(lines) > max_lines:
+        lines = lines[:max_lines]
+        lines[-1] += '...'
+    # Trim any line still too wide (a single long word) to fit
+    for i, line in enumerate(lines):
+        while text_width(line, font_size) > max_width and len(line) > 4:
+            line = line[:-4] + '...'
+        lines[i] = line
+    return lines
+
+
+def sticker_operators(x, y, layout, qr_name, qr_width, medication_name):
+    """Content stream operators for one label whose bottom-left corner is at (x, y), in points"""
+    label_width = layout['label_width'] * MM
+    label_height = layout['label_height'] * MM
+
+    # QR code on the left, vertically centred
+    qr_x = x + LABEL_PADDING
+    qr_y = y + (label_height - QR_SIZE) / 2
+    scale = QR_SIZE / qr_width
+    qr_operators = f"q {number(scale)} 0 0 {number(scale)} {number(qr_x)} {number(qr_y)} cm /{qr_name} Do Q"
+
+    # Medication name and note beside it, vertically centred as a block
+    text_x = qr_x + QR_SIZE + TEXT_GAP
+    text_max_width = x + label_width - LABEL_PADDING - text_x
+    name_lines = wrap_text(medication_name, NAME_FONT_SIZE, text_max_width, NAME_MAX_LINES) if medication_name else []
+    name_height = len(name_lines) * NAME_LINE_HEIGHT + 3 if name_lines else 0
+    block_top = y + (label_height + name_height + NOTE_FONT_SIZE) / 2
+
+    text = [f"BT /F1 {NAME_FONT_SIZE} Tf".encode()]
+    for i, line in enumerate(name_lines):
+        baseline = block_top - NAME_FONT_SIZE * 0.8 - i * NAME_LINE_HEIGHT
+        text.append(f"1 0 0 1 {number(text_x)} {number(baseline)} Tm ".encode() + pdf_string(line) + b" Tj")
+    note_baseline = block_top - name_height - NOTE_FONT_SIZE * 0.8
+    text.append(f"0.4 g /F1 {NOTE_FONT_SIZE} Tf 1 0 0 1 {number(text_x)} {number(note_baseline)} Tm ".encode()
+                + pdf_string(NOTE_TEXT) + b" Tj ET 0 g")
+    return qr_operators.encode() + b"\n" + b"\n".join(text)
+
+
+def write_sticker_sheet(output, stickers, renderer, layout, skip=0):
+    """
+    Write a PDF of QR code stickers to the binary file object output.
+    stickers is a list of (url, medication_name) pairs, one per label, in order;
+    skip leaves that many labels blank at the start of the first sheet, for part-used
+    sheets. Returns the number of pages written.
+    """
+    document = PdfDocument(output)
+    font = document.add(HELVETICA_FONT)
+    per_page = layout['columns'] * layout['rows']
+    label_width = layout['label_width'] * MM
+    label_height = layout['label_height'] * MM
+
+    # Object number, resource name and width of each distinct QR code's Form XObject
+    qr_forms = {}
+    page_numbers = []
+    positions = [None] * skip + list(stickers)
+
+    for page_start in range(0, len(positions), per_page):
+        page_stickers = positions[page_start:page_start + per_page]
+        contents = []
+        used_forms = {}
+
+        for index, sticker in enumerate(page_stickers):
+            if sticker is None:
+                continue
+            url, medication_name = sticker
+
+            if url not in qr_forms:
+                drawing, qr_width, _ = renderer.pdf_drawing(url)
+                form = document.add_stream(
+                    f"/Type /XObject /Subtype /Form /BBox [0 0 {number(qr_width)} {number(qr_width)}]".encode(),
+                    drawing)
+                qr_forms[url] = (form, f"QR{len(qr_forms)}", qr_width)
+            form, qr_name, qr_width = qr_forms[url]
+            used_forms[qr_name] = form
+
+            column = index % layout['columns']
+            row = index // layout['columns']
+            x = layout['left_margin'] * MM + column * (label_width + layout['column_gap'] * MM)
+            y = A4_HEIGHT - layout['top_margin'] * MM - row * (label_height + layout['row_gap'] * MM) - label_height
+            contents.append(sticker_operators(x, y, layout, qr_name, qr_width, medication_name))
+
+        content = document.add_stream(b'', b"\n".join(contents))
+        xobjects = ' '.join(f"/{name} {form} 0 R" for name, form in used_forms.items())
+        resources = f"<< /Font << /F1 {font} 0 R >> /XObject << {xobjects} >> >>".encode()
+        page_numbers.append(document.add_page(A4_WIDTH, A4_HEIGHT, content, resources))
+
+    document.finish(page_numbers)
+    return len(page_numbers)
@@ -0,0 +1,74 @@
+"""
+Request Logging
+
+Logging setup for the application. Every record carries a request_id field: the
+X-Request-ID header of the request being handled (or a new id when there isn't one),
+so the lines logged while handling one request can be picked out of a busy log.
+The id is sent back in the response's X-Request-ID header. Records are written as
+text lines or, with the 'json' format, one JSON object per line for log collectors.
+"""
+import json
+import logging
+import re
+import uuid
+
+from flask import g, has_request_context, request
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'
+
+# Request ids from clients are echoed in a response header, so only plain tokens are accepted
+REQUEST_ID_REGEX = re.compile(r'[A-Za-z0-9._-]{1,64}')
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds the current request's id to every record, '-' outside a request"""
+
+    def filter(self, record):
+        record.request_id = g.get('request_id', '-') if has_request_context() else '-'
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single-line JSON object"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def configure_logging(level='INFO', log_format='text'):
+    """Send log records at level and above to stderr, as 'text' or 'json' lines"""
+    if log_format not in ('text', 'json'):
+        raise ValueError(f"Unknown log format: {log_format}")
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+
+def init_request_ids(app):
+    """Give each request an id for its log records and return it in the X-Request-ID header"""
+
+    @app.before_request
+    def assign_request_id():
+        request_id = request.headers.get('X-Request-ID', '')
+        g.request_id = request_id if REQUEST_ID_REGEX.fullmatch(request_id) else uuid.uuid4().hex[:16]
+
+    @app.after_request
+    def send_request_id(response):
+        if 'request_id' in g:
+            response.headers['X-Request-ID'] = g.request_id
+        return response
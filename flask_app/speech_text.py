@@ -0,0 +1,34 @@
+"""
+Speech Text
+
+Turns an instruction's HTML (as shown on its instruction page) into plain text for
+text-to-speech: each tag becomes a pause ('. '), doubled-up full stops are merged and
+whitespace is collapsed. Every route that produces audio cleans text here, so the
+same instruction always gives the same spoken text and audio cache key.
+
+All tags are replaced in one pass of a single precompiled pattern, and results are
+memoised, since the same few hundred instructions are cleaned over and over.
+"""
+import re
+from functools import lru_cache
+
+# <br> and <strong> tags, which were replaced before any other tag
+PRIORITY_TAG = r'(?i:<br\s*/?>|</?strong>)'
+
+# A priority tag, or any other tag. A stray '<' before a priority tag runs on past it to
+# the next '>', and must not backtrack to stop at the priority tag's '>'. The lookahead
+# captures the run and the backreference consumes it whole, which makes it atomic without
+# Python 3.11's possessive repeat.
+TAG_REGEX = re.compile(rf'{PRIORITY_TAG}|<(?=((?:{PRIORITY_TAG}|[^>])*))\1>')
+DOUBLE_STOP_REGEX = re.compile(r'\.\s*\.')
+WHITESPACE_REGEX = re.compile(r'\s+')
+
+SPEECH_TEXT_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=SPEECH_TEXT_CACHE_SIZE)
+def html_to_speech_text(html):
+    """Plain text to read aloud for an instruction's HTML"""
+    text = TAG_REGEX.sub('. ', html)
+    text = DOUBLE_STOP_REGEX.sub('.', text)
+    return WHITESPACE_REGEX.sub(' ', text).strip()
@@ -5,6 +5,9 @@ let drugAliases = {}; // Will store drug name aliases
 let formulationAliases = {}; // Will store formulation aliases
 let formulationCategories = {}; // Will store formulation categories
 
+// Fingerprinted data file URLs, when the page sets them (see /original), else the plain static ones
+const assetUrls = window.ASSET_URLS || {};
+
 // Add error state tracking
 let dataLoadingState = {
     bnfLabels: false,
@@ -14,7 +17,7 @@ let dataLoadingState = {
 };
 
 // Load BNF labels data
-fetch('/static/bnf_labels.json')
+fetch(assetUrls['bnf_labels.json'] || '/static/bnf_labels.json')
   .then(response => {
     if (!response.ok) {
       throw new Error(`HTTP error! status: ${response.status}`);
@@ -39,7 +42,7 @@ fetch('/static/bnf_labels.json')
   });
 
 // Load drug formulations data
-fetch('/static/drug_formulations.json')
+fetch(assetUrls['drug_formulations.json'] || '/static/drug_formulations.json')
   .then(response => {
     if (!response.ok) {
       throw new Error(`HTTP error! status: ${response.status}`);
@@ -77,7 +80,7 @@ fetch('/static/drug_formulations.json')
   });
 
 // Load drug aliases if available
-fetch('/static/drug_aliases.json')
+fetch(assetUrls['drug_aliases.json'] || '/static/drug_aliases.json')
   .then(response => response.json())
   .then(data => {
     drugAliases = data;
@@ -91,7 +94,7 @@ fetch('/static/drug_aliases.json')
   });
 
 // Load formulation aliases data and transform it
-fetch('/static/formulation_aliases.json')
+fetch(assetUrls['formulation_aliases.json'] || '/static/formulation_aliases.json')
   .then(response => {
     if (!response.ok) {
       throw new Error(`HTTP error! status: ${response.status}`);
@@ -0,0 +1,97 @@
+"""
+Static Assets
+
+Holds the larger static files and pages in memory, fingerprinted by a hash of their
+content and precompressed with gzip (and brotli, when it is installed), so requests
+for them never read the disk or compress anything. Files are checked with a stat on
+each use and reloaded when their mtime or size changes, which also changes their
+fingerprint, so URLs that carry the fingerprint can be cached by browsers for good.
+"""
+import gzip
+import hashlib
+import os
+import threading
+from collections import namedtuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# Content codings, best first, used when the client accepts more than one
+PREFERRED_ENCODINGS = ('br', 'gzip')
+
+# A version of an asset: its fingerprint and its content in each coding, by coding name
+AssetVersion = namedtuple('AssetVersion', ['fingerprint', 'bodies'])
+
+
+def compress_asset(content, compress=True):
+    """Fingerprint content and, unless compress is False, precompress it in every available coding"""
+    bodies = {'identity': content}
+    if compress:
+        # mtime=0 keeps the gzip output, like the fingerprint, a function of the content alone
+        bodies['gzip'] = gzip.compress(content, GZIP_LEVEL, mtime=0)
+        if brotli is not None:
+            bodies['br'] = brotli.compress(content, quality=BROTLI_QUALITY)
+    # A coding that doesn't make the content smaller isn't worth sending
+    bodies = {coding: body for coding, body in bodies.items()
+              if coding == 'identity' or len(body) < len(content)}
+    return AssetVersion(hashlib.sha256(content).hexdigest()[:16], bodies)
+
+
+def choose_encoding(version, accept_encodings):
+    """The coding of version to send to a client, given its Accept-Encoding header (a werkzeug Accept)"""
+    for coding in PREFERRED_ENCODINGS:
+        if coding in version.bodies and accept_encodings.quality(coding) > 0:
+            return coding
+    return 'identity'
+
+
+class StaticAsset:
+    """A file held in memory, reloaded when its mtime or size changes"""
+
+    def __init__(self, path, mimetype, compress=True):
+        self.path = path
+        self.mimetype = mimetype
+        self.compress = compress
+        self.stamp = None
+        self.version = None
+        self.lock = threading.Lock()
+
+    def current(self):
+        """
+        The file's current version, reloading it if it has changed on disk.
+        Raises FileNotFoundError if the file has gone.
+        """
+        stat = os.stat(self.path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if stamp != self.stamp:
+                with open(self.path, 'rb') as f:
+                    self.version = compress_asset(f.read(), self.compress)
+                self.stamp = stamp
+            return self.version
+
+
+class BuiltAsset:
+    """
+    Content built by build(key) (e.g. a page with asset URLs filled in), held in memory
+    precompressed and rebuilt whenever the key it is asked for changes
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self.key = None
+        self.version = None
+        self.lock = threading.Lock()
+
+    def current(self, key):
+        """The content built for key, building it if key differs from the last one"""
+        with self.lock:
+            if key != self.key:
+                self.version = compress_asset(self.build(key))
+                self.key = key
+            return self.version
@@ -0,0 +1,139 @@
+"""
+TTS Backends
+
+Text-to-speech engines that can produce the spoken instructions. Each backend writes
+the audio for a text in a language (a gTTS language code such as 'en-gb') to a file,
+and describes its output: the file extension, and a voice name for the language that
+goes into the audio cache key, so changing engine or voice never serves stale audio.
+
+- GTTSBackend: Google Translate's TTS through gTTS; natural voices, but needs network
+  access and is rate limited
+- EspeakBackend: espeak-ng run as a local subprocess; fully offline and fast on CPU
+- PiperBackend: piper neural TTS run as a local subprocess; offline, more natural than
+  espeak-ng, but needs a voice model for each language
+- StubBackend: writes silent audio without any engine, for tests and benchmarks
+"""
+import os
+import shutil
+import subprocess
+import wave
+
+from gtts import gTTS
+
+# Longest a local engine may take over one instruction before it is treated as failed
+SUBPROCESS_TIMEOUT = 60
+
+# espeak-ng voices for the gTTS language codes whose names differ
+ESPEAK_VOICES = {
+    'zh-CN': 'cmn',
+}
+
+
+class GTTSBackend:
+    """Google Translate text-to-speech, as MP3"""
+    name = 'gtts'
+    extension = 'mp3'
+
+    def voice(self, lang):
+        return lang
+
+    def synthesise(self, text, lang, path):
+        gTTS(text=text, lang=lang, slow=False).save(path)
+
+
+class EspeakBackend:
+    """espeak-ng text-to-speech, as WAV"""
+    name = 'espeak'
+    extension = 'wav'
+
+    def __init__(self, binary='espeak-ng', speed=150):
+        self.binary = shutil.which(binary) or shutil.which('espeak')
+        if not self.binary:
+            raise ValueError(f"TTS backend 'espeak' needs {binary} installed")
+        self.speed = speed
+
+    def voice(self, lang):
+        return ESPEAK_VOICES.get(lang, lang.lower())
+
+    def synthesise(self, text, lang, path):
+        # Text goes in on stdin, so an instruction starting with '-' can't be read as an option
+        subprocess.run([self.binary, '-v', self.voice(lang), '-s', str(self.speed), '-w', path, '--stdin'],
+                       input=text.encode('utf-8'), check=True, capture_output=True, timeout=SUBPROCESS_TIMEOUT)
+
+
+class PiperBackend:
+    """piper text-to-speech, as WAV, with a voice model for each supported language"""
+    name = 'piper'
+    extension = 'wav'
+
+    def __init__(self, models, binary='piper'):
+        self.binary = shutil.which(binary)
+        if not self.binary:
+            raise ValueError(f"TTS backend 'piper' needs {binary} installed")
+        if not models:
+            raise ValueError("TTS backend 'piper' needs at least one voice model")
+        self.models = {lang.lower(): path for lang, path in models.items()}
+
+    def voice(self, lang):
+        model = self.models.get(lang.lower())
+        return os.path.basename(model) if model else None
+
+    def synthesise(self, text, lang, path):
+        model = self.models.get(lang.lower())
+        if model is None:
+            raise ValueError(f"No piper voice model for language {lang}")
+        subprocess.run([self.binary, '--model', model, '--output_file', path],
+                       input=text.encode('utf-8'), check=True, capture_output=True, timeout=SUBPROCESS_TIMEOUT)
+
+
+class StubBackend:
+    """Writes a short silent WAV, roughly as long as the text would take to say"""
+    name = 'stub'
+    extension = 'wav'
+    sample_rate = 8000
+
+    def voice(self, lang):
+        return lang
+
+    def synthesise(self, text, lang, path):
+        # About a third of a second per word
+        frames = self.sample_rate * max(1, len(text.split())) // 3
+        with wave.open(path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(1)
+            f.setframerate(self.sample_rate)
+            # 8-bit WAV samples are unsigned, so silence is 128
+            f.writeframes(b'\x80' * frames)
+
+
+TTS_BACKENDS = ('gtts', 'espeak', 'piper', 'stub')
+
+
+def parse_piper_models(spec):
+    """Parse "en-gb=/path/en_GB.onnx,fr=/path/fr_FR.onnx" into a language -> model path dict"""
+    models = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        lang, separator, path = item.partition('=')
+        if not separator or not lang.strip() or not path.strip():
+            raise ValueError(f"Invalid piper voice model setting: {item}")
+        models[lang.strip()] = path.strip()
+    return models
+
+
+def create_tts_backend(name, piper_models=''):
+    """
+    Create the text-to-speech backend called name ('gtts', 'espeak', 'piper' or 'stub').
+    piper_models lists piper's voice models as "lang=path,..." (see parse_piper_models()).
+    Raises ValueError for an unknown backend or a local engine that isn't installed.
+    """
+    if name == 'gtts':
+        return GTTSBackend()
+    if name == 'espeak':
+        return EspeakBackend()
+    if name == 'piper':
+        return PiperBackend(parse_piper_models(piper_models))
+    if name == 'stub':
+        return StubBackend()
+    raise ValueError(f"Unknown TTS backend: {name}")